@@ -1,98 +1,299 @@
 import json
 import time
-import os
-import re
+from concurrent.futures import ThreadPoolExecutor
 
-import requests
-
-from log import logger
+from audio import audio_extraction_params
+from cache import llm_cache, make_cache_key, transcript_cache
+from limits import resource_slot
+from llm_json import extract_json_items, validate_clips, validate_topics
+from log import log_payload, logger, propagate_context
+from metrics import LLM_CACHE_REQUESTS, LLM_REQUEST_SECONDS, LLM_TOKENS
+from transcript_format import TRANSCRIPT_FORMAT_NOTE, format_transcript, serialize_transcript
 from transcription_goal import TranscriptionGoal
 
 
-def start_transcription(url, config):
-    logger.debug(f"Starting transcription for URL: {url}")
-    headers = {
-        "Authorization": f"Bearer {config['replicate_api_key']}",
-        "Content-Type": "application/json",
+def transcription_params(config):
+    params = {
+        "debug": False,
+        "language": "en",
+        "vad_onset": 0.5,
+        "batch_size": 64,
+        "vad_offset": 0.363,
+        "diarization": False,
+        "temperature": 0,
+        "align_output": False,
+        "language_detection_min_prob": 0,
+        "language_detection_max_tries": 5,
     }
-    data = {
+    params.update(config.get("transcription_options") or {})
+    return params
+
+
+def transcript_cache_key(media_hash, config):
+    return make_cache_key(
+        "transcript",
+        media_hash,
+        config["replicate_model_version"],
+        transcription_params(config),
+        audio_extraction_params(config) if config.get("extract_audio", True) else None,
+    )
+
+
+def get_cached_transcript(media_hash, config):
+    cache = transcript_cache(config)
+    transcript = cache.get(transcript_cache_key(media_hash, config))
+    if transcript is None:
+        logger.info(f"Transcript cache miss for media {media_hash}")
+    else:
+        logger.info(f"Transcript cache hit for media {media_hash}")
+    return transcript
+
+
+def cache_transcript(media_hash, transcript, config):
+    transcript_cache(config).set(transcript_cache_key(media_hash, config), transcript)
+    logger.info(f"Transcript cached for media {media_hash}")
+
+
+def get_client(provider, config):
+    # requests is imported with the first API call rather than with this module
+    from api_client import get_api_client
+
+    return get_api_client(provider, config)
+
+
+def transcription_request(url, config):
+    return {
         "version": config["replicate_model_version"],
         "input": {
-            "debug": False,
-            "language": "en",
-            "vad_onset": 0.5,
+            **transcription_params(config),
             "audio_file": url,
-            "batch_size": 64,
-            "vad_offset": 0.363,
-            "diarization": False,
-            "temperature": 0,
-            "align_output": False,
             "huggingface_access_token": config["huggingface_token"],
-            "language_detection_min_prob": 0,
-            "language_detection_max_tries": 5,
         },
     }
-    logger.debug(f"Sending request to Replicate API: {config['replicate_api_url']}")
-    response = requests.post(config["replicate_api_url"], headers=headers, json=data)
-    logger.debug(f"Replicate API response: {response.text}")
-    return response.json()
-
-
-def get_transcription_result(prediction_url, config):
-    logger.debug(f"Getting transcription result from: {prediction_url}")
-    headers = {"Authorization": f"Bearer {config['replicate_api_key']}"}
-    while True:
-        response = requests.get(prediction_url, headers=headers)
-        result = response.json()
-        logger.debug(f"Transcription status: {result['status']}")
-        if result["status"] == "succeeded":
-            logger.info("Transcription completed successfully")
-            return result["output"]["segments"]
-        elif result["status"] == "failed":
-            logger.error("Transcription process failed")
-            raise Exception("Transcription process failed.")
-        time.sleep(5)
-
-
-def generate_content(transcript, goal, config):
-    logger.debug(f"Generating content for goal: {goal.value}")
+
+
+def transcript_digest(transcript):
+    return make_cache_key(transcript)
+
+
+def read_anthropic_stream(response, on_text):
+    # Server-sent events: text arrives in content_block_delta events, token
+    # usage in message_start (input) and message_delta (output)
+    response.encoding = "utf-8"
+    parts = []
+    usage = {}
+    for line in response.iter_lines(decode_unicode=True):
+        if not line or not line.startswith("data:"):
+            continue
+        event = json.loads(line[len("data:"):])
+        if event["type"] == "content_block_delta" and event["delta"].get("type") == "text_delta":
+            parts.append(event["delta"]["text"])
+            on_text(event["delta"]["text"])
+        elif event["type"] == "message_start":
+            usage.update(event["message"].get("usage") or {})
+        elif event["type"] == "message_delta":
+            usage.update(event.get("usage") or {})
+        elif event["type"] == "error":
+            raise Exception(f"Anthropic stream error: {event['error'].get('message')}")
+    return "".join(parts), usage
+
+
+def anthropic_request(data, config, cache_parts=None, use_cache=True, on_text=None):
+    # Requests are deterministic (temperature 0), so a response can be reused
+    # whenever the model, prompt template, goal and inputs are unchanged.
+    # With `on_text` the response is streamed and each piece of text passed on
+    # as it arrives; a cached response is passed on whole.
+    call = cache_parts[0] if cache_parts else "uncached"
+    cache_key = None
+    if use_cache and cache_parts is not None:
+        cache_key = make_cache_key("anthropic", data["model"], data["max_tokens"], data.get("temperature"), *cache_parts)
+        text = llm_cache(config).get(cache_key)
+        if text is not None:
+            logger.info(f"LLM cache hit for {call}")
+            LLM_CACHE_REQUESTS.inc(call=call, result="hit")
+            if on_text is not None:
+                on_text(text)
+            return text
+        logger.info(f"LLM cache miss for {call}")
+        LLM_CACHE_REQUESTS.inc(call=call, result="miss")
+
     headers = {
         "x-api-key": config["anthropic_api_key"],
         "anthropic-version": "2023-06-01",
         "content-type": "application/json",
     }
+    stream = on_text is not None and config.get("anthropic_stream", True)
+    client = get_client("anthropic", config)
+    # The estimate reserves input tokens against the per-minute token limit
+    input_tokens = estimate_tokens(json.dumps(data["messages"]))
+    logger.debug(f"Sending request to Anthropic API: {config['anthropic_api_url']}")
+    with resource_slot("llm"), LLM_REQUEST_SECONDS.time(call=call):
+        response = client.request(
+            "POST",
+            config["anthropic_api_url"],
+            tokens=input_tokens,
+            headers=headers,
+            json={**data, "stream": True} if stream else data,
+            stream=stream,
+        )
+        if stream and response.ok:
+            with response:
+                text, usage = read_anthropic_stream(response, on_text)
+            log_payload("Anthropic API streamed text", text)
+        else:
+            log_payload("Anthropic API response", lambda: response.text)
+            response.raise_for_status()
+            body = response.json()
+            text = body["content"][0]["text"]
+            usage = body.get("usage") or {}
+            if on_text is not None:
+                on_text(text)
+    LLM_TOKENS.observe(usage.get("input_tokens", 0), call=call, direction="input")
+    LLM_TOKENS.observe(usage.get("output_tokens", 0), call=call, direction="output")
 
-    prompts = {
-        TranscriptionGoal.MEETING_MINUTES: "Create very detailed meeting minutes based on the following transcription:",
-        TranscriptionGoal.PODCAST_SUMMARY: "Summarize this podcast episode, highlighting key points and interesting discussions:",
-        TranscriptionGoal.LECTURE_NOTES: "Create comprehensive lecture notes from this transcription, organizing key concepts and examples:",
-        TranscriptionGoal.INTERVIEW_HIGHLIGHTS: "Extract the main insights and notable quotes from this interview transcription:",
-        TranscriptionGoal.GENERAL_TRANSCRIPTION: "Provide a clear and concise summary of the main points discussed in this transcription:",
-    }
+    if cache_key is not None:
+        llm_cache(config).set(cache_key, text)
+    return text
+
+
+CONTENT_PROMPTS = {
+    TranscriptionGoal.MEETING_MINUTES: "Create very detailed meeting minutes based on the following transcription:",
+    TranscriptionGoal.PODCAST_SUMMARY: "Summarize this podcast episode, highlighting key points and interesting discussions:",
+    TranscriptionGoal.LECTURE_NOTES: "Create comprehensive lecture notes from this transcription, organizing key concepts and examples:",
+    TranscriptionGoal.INTERVIEW_HIGHLIGHTS: "Extract the main insights and notable quotes from this interview transcription:",
+    TranscriptionGoal.GENERAL_TRANSCRIPTION: "Provide a clear and concise summary of the main points discussed in this transcription:",
+}
+
+CHUNK_SUMMARY_PROMPT = (
+    "The following is part {index} of {count} of a longer transcription, to be turned into {goal}. "
+    "Write detailed notes for this part only, keeping names, decisions, figures, notable quotes "
+    "and the approximate start time in seconds of each topic:"
+)
+
+JSON_REPAIR_PROMPT = (
+    "An earlier answer could not be used. Respond with only the JSON array, with no other text."
+)
+
+REDUCE_PROMPT_SUFFIX = (
+    "The transcription was too long to include directly, so it has been condensed into the "
+    "following notes, one section per part, in chronological order:"
+)
+
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English text
+    return len(text) // 4 + 1
+
+
+def chunk_transcript(transcript, max_tokens, config):
+    chunks = []
+    current = []
+    current_tokens = 0
+    for segment in transcript:
+        segment_tokens = estimate_tokens(
+            format_transcript([segment], config.get("transcript_time_precision", 1), merge_seconds=0)
+        )
+        if current and current_tokens + segment_tokens > max_tokens:
+            chunks.append(current)
+            current = []
+            current_tokens = 0
+        current.append(segment)
+        current_tokens += segment_tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def generate_content(transcript, goal, config, use_cache=True, timings=None, on_text=None):
+    logger.debug(f"Generating content for goal: {goal.value}")
+    timings = timings if timings is not None else {}
+    started = time.monotonic()
+
+    prompt = CONTENT_PROMPTS.get(goal, CONTENT_PROMPTS[TranscriptionGoal.GENERAL_TRANSCRIPTION])
+
+    chunk_tokens = config.get("summary_chunk_tokens", 30000)
+    transcript_text = serialize_transcript(transcript, config)
+    if not config.get("summary_map_reduce", True) or estimate_tokens(transcript_text) <= chunk_tokens:
+        data = {
+            "model": config["anthropic_model"],
+            "temperature": 0,
+            "max_tokens": 4000,
+            "messages": [{"role": "user", "content": f"{prompt}\n{transcript_text}"}],
+        }
+        text = anthropic_request(
+            data,
+            config,
+            cache_parts=("content_generation", prompt, goal.value, make_cache_key(transcript_text)),
+            use_cache=use_cache,
+            on_text=on_text,
+        )
+        timings["single_call_seconds"] = time.monotonic() - started
+    else:
+        text = map_reduce_content(transcript, goal, prompt, chunk_tokens, config, use_cache, timings, on_text)
 
-    prompt = prompts.get(goal, prompts[TranscriptionGoal.GENERAL_TRANSCRIPTION])
+    timings["total_seconds"] = time.monotonic() - started
+    logger.info(f"Content generation timings: {timings}")
 
+    log_payload("AI response for content generation", text)
+
+    return text
+
+
+def map_reduce_content(transcript, goal, prompt, chunk_tokens, config, use_cache, timings, on_text=None):
+    chunks = chunk_transcript(transcript, chunk_tokens, config)
+    goal_name = goal.value.replace('_', ' ')
+    logger.info(f"Transcript split into {len(chunks)} chunks for map-reduce summarization")
+
+    def summarize_chunk(index_and_chunk):
+        index, chunk = index_and_chunk
+        chunk_prompt = CHUNK_SUMMARY_PROMPT.format(index=index + 1, count=len(chunks), goal=goal_name)
+        chunk_text = serialize_transcript(chunk, config)
+        data = {
+            "model": config["anthropic_model"],
+            "temperature": 0,
+            "max_tokens": config.get("summary_chunk_max_tokens", 1500),
+            "messages": [{"role": "user", "content": f"{chunk_prompt}\n{chunk_text}"}],
+        }
+        chunk_started = time.monotonic()
+        text = anthropic_request(
+            data,
+            config,
+            cache_parts=("content_chunk", chunk_prompt, goal.value, make_cache_key(chunk_text)),
+            use_cache=use_cache,
+        )
+        return text, time.monotonic() - chunk_started
+
+    map_started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=config.get("summary_concurrency", 4)) as executor:
+        results = list(executor.map(propagate_context(summarize_chunk), enumerate(chunks)))
+    timings["chunks"] = len(chunks)
+    timings["map_seconds"] = time.monotonic() - map_started
+    timings["chunk_seconds"] = [round(seconds, 3) for _, seconds in results]
+
+    notes = "\n\n".join(
+        f"## Part {index + 1} of {len(chunks)}\n{text}" for index, (text, _) in enumerate(results)
+    )
     data = {
         "model": config["anthropic_model"],
         "temperature": 0,
         "max_tokens": 4000,
-        "messages": [{"role": "user", "content": f"{prompt} {json.dumps(transcript)}"}],
+        "messages": [{"role": "user", "content": f"{prompt}\n\n{REDUCE_PROMPT_SUFFIX}\n\n{notes}"}],
     }
-    logger.debug(f"Sending request to Anthropic API: {config['anthropic_api_url']}")
-    response = requests.post(config["anthropic_api_url"], headers=headers, json=data)
-    print(response)
-    logger.debug(f"Anthropic API response: {response.text}")
-
-    # Log the full AI response
-    logger.debug(
-        f"Full AI response for content generation:\n{response.json()['content'][0]['text']}"
+    reduce_started = time.monotonic()
+    text = anthropic_request(
+        data,
+        config,
+        cache_parts=("content_reduce", prompt, goal.value, make_cache_key(notes)),
+        use_cache=use_cache,
+        # Only the final summary is streamed; the per-chunk notes are intermediate
+        on_text=on_text,
     )
-
-    return response.json()["content"][0]["text"]
+    timings["reduce_seconds"] = time.monotonic() - reduce_started
+    return text
 
 
-def create_media_clips(transcript, content, source_file, dest_folder, goal, config):
-    logger.debug(f"Creating media clips for goal: {goal.value}")
+def extract_topics(content, goal, config, use_cache=True):
+    logger.debug(f"Extracting topics for goal: {goal.value}")
     topic_extraction_message = f"""
     Based on the following {goal.value.replace('_', ' ')}:
     {content}
@@ -105,38 +306,128 @@ def create_media_clips(transcript, content, source_file, dest_folder, goal, conf
 
     Format the response as a JSON array of objects, each containing 'title' and 'keywords' fields.
     """
-    headers = {
-        "x-api-key": config['anthropic_api_key'],
-        "anthropic-version": "2023-06-01",
-        "content-type": "application/json"
-    }
     topic_extraction_data = {
         "model": config['anthropic_model'],
+        "temperature": 0,
         "max_tokens": 1000,
         "messages": [
             {"role": "user", "content": topic_extraction_message}
         ]
     }
-    topic_response = requests.post(config['anthropic_api_url'], headers=headers, json=topic_extraction_data)
-    topic_text = topic_response.json()['content'][0]['text']
-    logger.debug(f"Full AI response for topic extraction:\n{topic_text}")
+    topic_text = anthropic_request(
+        topic_extraction_data,
+        config,
+        cache_parts=("topic_extraction", make_cache_key(topic_extraction_message), goal.value),
+        use_cache=use_cache,
+    )
+    log_payload("AI response for topic extraction", topic_text)
+    topics = validate_topics(extract_json_items(topic_text))
 
-    try:
-        topics = json.loads(topic_text)
-    except json.JSONDecodeError:
-        topic_pattern = r'\{\s*"title":\s*"([^"]+)",\s*"keywords":\s*\[((?:[^]]+))\]\s*\}'  
-        matches = re.findall(topic_pattern, topic_text)
-        topics = [{"title": title, "keywords": [k.strip(' "') for k in keywords.split(',')]} for title, keywords in matches]
+    for _ in range(config.get("llm_json_repair_attempts", 1)):
+        if topics:
+            break
+        # Nothing usable came back; continuing the conversation costs one call
+        # instead of failing the job and redoing everything before this step
+        logger.warning("No valid topics in the AI response, asking for the JSON array again")
+        repair_data = {
+            **topic_extraction_data,
+            "messages": [
+                {"role": "user", "content": topic_extraction_message},
+                {"role": "assistant", "content": topic_text.strip() or "(empty response)"},
+                {"role": "user", "content": JSON_REPAIR_PROMPT},
+            ],
+        }
+        topic_text = anthropic_request(
+            repair_data,
+            config,
+            cache_parts=("topic_repair", make_cache_key(topic_extraction_message), goal.value, make_cache_key(topic_text)),
+            use_cache=use_cache,
+        )
+        log_payload("AI response for topic extraction retry", topic_text)
+        topics = validate_topics(extract_json_items(topic_text))
 
     if not topics:
         raise ValueError("Failed to extract topics from the AI response")
 
+    return topics
+
+
+def select_clips(transcript, topics, goal, config, use_cache=True):
+    clip_selection = config.get("clip_selection", "retrieval")
+    if clip_selection == "local":
+        from retrieval import select_clips_locally  # numpy is only needed to rank clips locally
+
+        clips = select_clips_locally(transcript, topics, config)
+        logger.info(f"Selected {len(clips)} clips locally without an LLM call")
+    else:
+        clips = generate_clip_times(transcript, topics, goal, config, clip_selection, use_cache)
+
+    if not clips:
+        raise ValueError("Failed to extract clip information from the AI response")
+
+    return clips
+
+
+def format_candidate_windows(topics, candidates, config):
+    sections = []
+    for topic, windows in zip(topics, candidates):
+        # Candidate windows overlap, so each segment is listed once
+        segments = sorted(
+            {id(segment): segment for window in windows for segment in window["segments"]}.values(),
+            key=lambda segment: segment["start"],
+        )
+        excerpts = format_transcript(
+            segments,
+            config.get("transcript_time_precision", 1),
+            config.get("transcript_merge_seconds", 3.0),
+        ) or "(no matching excerpt found)"
+        sections.append(f"### {topic['title']}\n{excerpts}")
+    return "\n\n".join(sections)
+
+
+def transcript_bounds(transcript):
+    return 0.0, max((segment["end"] for segment in transcript), default=0.0)
+
+
+def generate_clip_times(transcript, topics, goal, config, clip_selection, use_cache):
+    bounds = transcript_bounds(transcript)
+    clip_text = request_clip_times(transcript, topics, goal, config, clip_selection, use_cache)
+    clips, missing = validate_clips(extract_json_items(clip_text), topics, bounds)
+
+    for _ in range(config.get("llm_json_repair_attempts", 1)):
+        if not missing:
+            break
+        # Only the topics without a usable clip are asked for again
+        logger.warning(f"No valid clip for {len(missing)} of {len(topics)} topics, asking again for those")
+        clip_text = request_clip_times(transcript, missing, goal, config, clip_selection, use_cache, retry=True)
+        retried, missing = validate_clips(extract_json_items(clip_text), missing, bounds)
+        clips += retried
+
+    if missing:
+        logger.warning(f"No clip found for topics: {[topic['title'] for topic in missing]}")
+    order = {topic["title"]: index for index, topic in enumerate(topics)}
+    return sorted(clips, key=lambda clip: order[clip["title"]])
+
+
+def request_clip_times(transcript, topics, goal, config, clip_selection, use_cache, retry=False):
+    if clip_selection == "retrieval":
+        # Only the best-matching windows for each topic are sent, so prompt size
+        # no longer grows with the transcript
+        from retrieval import find_candidate_windows
+
+        candidates = find_candidate_windows(transcript, topics, config)
+        transcript_section = (
+            "Candidate transcript excerpts for each topic, found by keyword search "
+            f"({TRANSCRIPT_FORMAT_NOTE}):\n{format_candidate_windows(topics, candidates, config)}"
+        )
+    else:
+        transcript_section = f"Transcript:\n{serialize_transcript(transcript, config)}"
+
     clip_generation_message = f"""
     For each of the following topics/segments, find the most relevant part in the transcript:
     {json.dumps(topics)}
 
-    Transcript:
-    {json.dumps(transcript)}
+    {transcript_section}
 
     For each topic/segment:
     1. Find the part that best represents the topic/segment.
@@ -152,41 +443,26 @@ def create_media_clips(transcript, content, source_file, dest_folder, goal, conf
 
     The clips can overlap if necessary to capture complete discussions or segments.
     """
+    if retry:
+        first, last = transcript_bounds(transcript)
+        clip_generation_message += (
+            f"\n    {JSON_REPAIR_PROMPT} Start and end must be numbers of seconds between {first:g} and {last:g}.\n"
+        )
 
     clip_generation_data = {
         "model": config['anthropic_model'],
+        "temperature": 0,
         "max_tokens": 2000,
         "messages": [
             {"role": "user", "content": clip_generation_message}
         ]
     }
 
-    clip_response = requests.post(config['anthropic_api_url'], headers=headers, json=clip_generation_data)
-    clip_text = clip_response.json()['content'][0]['text']
-    logger.debug(f"Full AI response for clip generation:\n{clip_text}")
-
-    try:
-        clips = json.loads(clip_text)
-    except json.JSONDecodeError:
-        clip_pattern = r'\{\s*"title":\s*"([^"]+)",\s*"start":\s*(\d+(?:\.\d+)?),\s*"end":\s*(\d+(?:\.\d+)?)\s*\}'
-        matches = re.findall(clip_pattern, clip_text)
-        clips = [{"title": title, "start": float(start), "end": float(end)} for title, start, end in matches]
-
-    if not clips:
-        raise ValueError("Failed to extract clip information from the AI response")
-
-    ffmpeg_commands = []
-    for clip in clips:
-        safe_title = ''.join(c for c in clip['title'] if c.isalnum() or c in (' ', '_')).rstrip()
-        safe_title = safe_title.replace(' ', '_')
-        output_file = os.path.join(dest_folder, f"{safe_title}{os.path.splitext(source_file)[1]}")
-        start_time = clip['start']
-        end_time = clip['end']
-        buffer = 0.5
-        start_time = max(0, start_time - buffer)
-        end_time += buffer
-        command = f"/opt/homebrew/bin/ffmpeg -i {source_file} -ss {start_time:.2f} -to {end_time:.2f} -y -c copy {output_file}"
-        ffmpeg_commands.append(command)
-
-    logger.debug(f"Generated FFmpeg commands: {ffmpeg_commands}")
-    return ' && '.join(ffmpeg_commands), topics, clips
\ No newline at end of file
+    clip_text = anthropic_request(
+        clip_generation_data,
+        config,
+        cache_parts=("clip_generation", make_cache_key(clip_generation_message), goal.value, transcript_digest(transcript)),
+        use_cache=use_cache,
+    )
+    log_payload("AI response for clip generation", clip_text)
+    return clip_text
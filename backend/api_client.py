@@ -0,0 +1,242 @@
+import asyncio
+import random
+import threading
+import time
+from datetime import datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from log import log_payload, logger
+from metrics import API_RETRIES, RATE_LIMIT_WAIT_SECONDS
+
+
+RETRY_STATUSES = (408, 429, 500, 502, 503, 504, 529)
+
+PROVIDER_DEFAULTS = {
+    # Conservative starting limits; Anthropic's rate-limit headers replace them after the first response
+    "anthropic": {"requests_per_minute": 50, "deadline": 600.0},
+    "replicate": {"requests_per_minute": 600, "deadline": 60.0},
+}
+
+
+class DeadlineExceededError(requests.exceptions.Timeout):
+    pass
+
+
+class TokenBucket:
+    """Blocking token bucket refilled continuously at `per_minute` tokens per minute."""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = float(per_minute)
+        self.paused_until = 0.0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _reserve(self, amount, deadline):
+        # Takes the tokens and returns 0, or returns how long to wait before trying again.
+        # A request larger than the whole bucket would never fit; let it through once full
+        amount = min(amount, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if now >= self.paused_until and self.tokens >= amount:
+                self.tokens -= amount
+                return 0.0
+            wait = max(self.paused_until - now, (amount - self.tokens) / self.rate if self.rate else 1.0)
+        if deadline is not None and now + wait > deadline:
+            raise DeadlineExceededError("Request deadline would pass while waiting for the rate limit")
+        return min(wait, 1.0)
+
+    def acquire(self, amount=1, deadline=None):
+        waited = 0.0
+        while True:
+            wait = self._reserve(amount, deadline)
+            if not wait:
+                return waited
+            time.sleep(wait)
+            waited += wait
+
+    async def acquire_async(self, amount=1, deadline=None):
+        waited = 0.0
+        while True:
+            wait = self._reserve(amount, deadline)
+            if not wait:
+                return waited
+            await asyncio.sleep(wait)
+            waited += wait
+
+    def update(self, limit=None, remaining=None):
+        # Adopts the provider's view of the limit and of what is left of it
+        with self._lock:
+            self._refill(time.monotonic())
+            if limit:
+                self.capacity = float(limit)
+                self.rate = limit / 60.0
+            if remaining is not None:
+                self.tokens = min(self.tokens, float(remaining))
+
+    def pause(self, seconds):
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+def header_number(headers, name):
+    value = headers.get(name)
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def backoff_delay(attempt, base, maximum, retry_after=None):
+    # Full jitter, but never sooner than the provider asked for
+    delay = random.uniform(0, min(maximum, base * 2 ** attempt))
+    return max(delay, retry_after or 0.0)
+
+
+def retry_after_seconds(headers):
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (datetime.strptime(value, "%a, %d %b %Y %H:%M:%S GMT") - datetime.utcnow()).total_seconds())
+    except ValueError:
+        return None
+
+
+def client_settings(provider, config):
+    defaults = PROVIDER_DEFAULTS.get(provider, {"requests_per_minute": 60, "deadline": 60.0})
+    return {
+        "max_attempts": config.get(f"{provider}_max_attempts", 5),
+        "backoff_base": config.get("api_backoff_base", 0.5),
+        "backoff_max": config.get("api_backoff_max", 30.0),
+        "connect_timeout": config.get("api_connect_timeout", 10.0),
+        "read_timeout": config.get(f"{provider}_read_timeout", defaults["deadline"]),
+        "deadline": config.get(f"{provider}_request_deadline", defaults["deadline"]),
+        "requests_per_minute": config.get(f"{provider}_requests_per_minute", defaults["requests_per_minute"]),
+        "tokens_per_minute": config.get(f"{provider}_tokens_per_minute"),
+        "max_connections": config.get("api_max_connections", 32),
+    }
+
+
+class ApiClient:
+    """Pooled keep-alive session for one API provider, shared by every job and thread.
+
+    Requests pass through per-provider request and token buckets whose limits
+    follow the provider's rate-limit headers. Transient failures are retried with
+    jittered exponential backoff, within an overall deadline per request.
+    """
+
+    def __init__(self, provider, config):
+        settings = client_settings(provider, config)
+        self.provider = provider
+        self.max_attempts = settings["max_attempts"]
+        self.backoff_base = settings["backoff_base"]
+        self.backoff_max = settings["backoff_max"]
+        self.connect_timeout = settings["connect_timeout"]
+        self.read_timeout = settings["read_timeout"]
+        self.deadline = settings["deadline"]
+        self.requests_bucket = TokenBucket(settings["requests_per_minute"])
+        tokens_per_minute = settings["tokens_per_minute"]
+        self.tokens_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=settings["max_connections"], max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _update_limits(self, headers):
+        prefix = f"{self.provider}-ratelimit-"
+        self.requests_bucket.update(
+            header_number(headers, f"{prefix}requests-limit"),
+            header_number(headers, f"{prefix}requests-remaining"),
+        )
+        token_limit = header_number(headers, f"{prefix}input-tokens-limit") or header_number(headers, f"{prefix}tokens-limit")
+        if token_limit:
+            if self.tokens_bucket is None:
+                self.tokens_bucket = TokenBucket(token_limit)
+            token_remaining = header_number(headers, f"{prefix}input-tokens-remaining")
+            if token_remaining is None:
+                token_remaining = header_number(headers, f"{prefix}tokens-remaining")
+            self.tokens_bucket.update(token_limit, token_remaining)
+
+    def request(self, method, url, tokens=0, idempotent=True, deadline=None, **kwargs):
+        # Non-idempotent requests (creating a prediction) are only retried when the
+        # provider certainly did not act on them: rate limiting and failed connections
+        deadline = time.monotonic() + (deadline or self.deadline)
+        attempt = 0
+        while True:
+            attempt += 1
+            waited = self.requests_bucket.acquire(1, deadline)
+            if tokens and self.tokens_bucket is not None:
+                waited += self.tokens_bucket.acquire(tokens, deadline)
+            if waited:
+                RATE_LIMIT_WAIT_SECONDS.observe(waited, provider=self.provider)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise DeadlineExceededError(f"{self.provider} request deadline exceeded")
+
+            retry_after = None
+            error = None
+            try:
+                response = self.session.request(
+                    method, url, timeout=(self.connect_timeout, min(self.read_timeout, remaining)), **kwargs
+                )
+            except requests.exceptions.ConnectionError as e:
+                error = e
+                retryable = True
+            except requests.exceptions.Timeout as e:
+                error = e
+                retryable = idempotent
+            else:
+                self._update_limits(response.headers)
+                retry_after = retry_after_seconds(response.headers)
+                if response.status_code == 429 and retry_after:
+                    # Every caller on this provider backs off, not just this one
+                    self.requests_bucket.pause(retry_after)
+                if response.status_code not in RETRY_STATUSES:
+                    return response
+                retryable = idempotent or response.status_code == 429
+                log_payload(f"{self.provider} API error response ({response.status_code})", lambda: response.text)
+
+            delay = backoff_delay(attempt, self.backoff_base, self.backoff_max, retry_after)
+            if not retryable or attempt >= self.max_attempts or time.monotonic() + delay >= deadline:
+                if error is not None:
+                    raise error
+                return response
+            API_RETRIES.inc(provider=self.provider)
+            logger.warning(
+                f"{self.provider} request failed ({error or response.status_code}), "
+                f"retrying in {delay:.1f}s (attempt {attempt}/{self.max_attempts})"
+            )
+            if error is None:
+                response.close()
+            time.sleep(delay)
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_api_client(provider, config):
+    # Callers with the same provider settings share one client, and with it the
+    # connection pool and rate-limit buckets; a config with different settings
+    # gets a client of its own instead of silently reusing the first one's
+    settings = client_settings(provider, config)
+    key = (provider, tuple(sorted(settings.items())))
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = ApiClient(provider, config)
+        return client
@@ -0,0 +1,85 @@
+import os
+import subprocess
+import time
+
+from cache import audio_cache, make_cache_key
+from clips import get_ffmpeg_path
+from limits import resource_slot
+from log import logger
+from metrics import FFMPEG_OUTPUT_BYTES, FFMPEG_SECONDS
+
+
+AUDIO_FORMATS = {
+    # extension: ffmpeg codec arguments
+    "ogg": ["-c:a", "libopus", "-b:a", "32k", "-application", "voip"],
+    "mp3": ["-c:a", "libmp3lame", "-b:a", "48k"],
+    "flac": ["-c:a", "flac"],
+}
+
+
+def audio_extraction_params(config):
+    audio_format = config.get('audio_format', 'ogg')
+    if audio_format not in AUDIO_FORMATS:
+        raise ValueError(f"Unsupported audio format: {audio_format}")
+    return {
+        "format": audio_format,
+        "sample_rate": config.get('audio_sample_rate', 16000),
+        "channels": 1,
+    }
+
+
+def extract_audio(media_file, media_hash, config):
+    params = audio_extraction_params(config)
+    suffix = f".{params['format']}"
+    cache = audio_cache(config)
+    key = make_cache_key("audio", media_hash, params)
+
+    cached_path = cache.get_file(key, suffix)
+    if cached_path:
+        logger.info(f"Audio cache hit for {media_file}: {cached_path}")
+        return cached_path
+
+    tmp_path = cache.temp_file(key, suffix)
+    command = [
+        get_ffmpeg_path(config),
+        "-hide_banner",
+        "-loglevel", "error",
+        "-i", media_file,
+        "-vn",
+        "-ac", str(params['channels']),
+        "-ar", str(params['sample_rate']),
+        *AUDIO_FORMATS[params['format']],
+        "-y",
+        tmp_path,
+    ]
+    logger.debug("Extracting audio: %s", command)
+    try:
+        with resource_slot("ffmpeg"):
+            started = time.monotonic()
+            subprocess.run(command, capture_output=True, text=True, check=True)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    audio_path = cache.put_file(key, suffix, tmp_path)
+
+    source_size = os.path.getsize(media_file)
+    audio_size = os.path.getsize(audio_path)
+    FFMPEG_SECONDS.observe(time.monotonic() - started, operation="audio")
+    FFMPEG_OUTPUT_BYTES.observe(audio_size, operation="audio")
+    logger.info(
+        f"Extracted audio in {time.monotonic() - started:.2f}s: "
+        f"{source_size} -> {audio_size} bytes ({source_size / max(audio_size, 1):.1f}x smaller)"
+    )
+    return audio_path
+
+
+def prepare_upload_file(media_file, media_hash, config):
+    # WhisperX only needs the audio track; the original file stays in place for clip cutting
+    if not config.get('extract_audio', True):
+        return media_file
+    try:
+        return extract_audio(media_file, media_hash, config)
+    except (subprocess.CalledProcessError, OSError) as e:
+        stderr = getattr(e, 'stderr', '') or ''
+        logger.warning(f"Audio extraction failed, uploading original file instead: {str(e)} {stderr.strip()}")
+        return media_file
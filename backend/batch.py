@@ -0,0 +1,155 @@
+import asyncio
+import csv
+import glob
+import json
+import os
+import threading
+import time
+
+from checkpoints import Checkpoint, open_checkpoint
+from limits import set_call_limits
+from log import logger, set_log_context
+from pipeline import build_media_pipeline, get_checkpoint_path, get_goal_folder, get_output_folder
+from transcription_goal import goals_label, parse_goals
+from utils import SUPPORTED_EXTENSIONS, hash_file
+
+
+def is_media_file(path):
+    return os.path.isfile(path) and path.lower().endswith(SUPPORTED_EXTENSIONS)
+
+
+def expand_inputs(inputs, recursive=False):
+    # Directories, glob patterns and plain file paths, in a stable order without duplicates
+    files = []
+    for item in inputs:
+        if os.path.isdir(item):
+            pattern = os.path.join(item, '**', '*') if recursive else os.path.join(item, '*')
+            matches = sorted(glob.glob(pattern, recursive=recursive))
+        elif glob.has_magic(item):
+            matches = sorted(glob.glob(item, recursive=recursive))
+        else:
+            matches = [item]
+        for path in matches:
+            if is_media_file(path):
+                files.append(os.path.abspath(path))
+            elif path == item:
+                logger.warning(f"Skipping unsupported or missing file: {path}")
+    return list(dict.fromkeys(files))
+
+
+def load_manifest(manifest_path, default_goals):
+    # CSV rows of "path[,goal+goal]" or a JSON list of {"file": ..., "goals": [...]}
+    # ("goal" is accepted too); relative paths are resolved against the manifest's directory
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    with open(manifest_path, 'r') as f:
+        if manifest_path.lower().endswith('.json'):
+            rows = [(entry['file'], entry.get('goals') or entry.get('goal')) for entry in json.load(f)]
+        else:
+            rows = [
+                (row[0].strip(), row[1].strip() if len(row) > 1 and row[1].strip() else None)
+                for row in csv.reader(f)
+                if row and row[0].strip() and not row[0].startswith('#')
+            ]
+    items = []
+    for path, goals in rows:
+        path = os.path.join(base_dir, path) if not os.path.isabs(path) else path
+        items.append((path, parse_goals(goals) if goals else default_goals))
+    return items
+
+
+def is_completed(media_file, goals):
+    checkpoint_path = get_checkpoint_path(media_file, goals)
+    if os.path.exists(checkpoint_path):
+        return Checkpoint(checkpoint_path).status == "completed"
+    output_folder, output_name = get_output_folder(media_file)
+    return all(
+        os.path.exists(os.path.join(output_folder, f"{output_name}_{goal.value}.md"))
+        and os.path.exists(os.path.join(get_goal_folder(output_folder, goals, goal), "debug_info.txt"))
+        for goal in goals
+    )
+
+
+STAGE_LIMITS = {"upload": 4, "transcription": 8}
+CALL_LIMITS = {"llm": 4, "ffmpeg": os.cpu_count() or 2}
+
+
+def make_limits(config, overrides=None):
+    # Uploads and transcriptions are one per stage, so they are limited per
+    # pipeline stage. A single stage can start many ffmpeg processes or LLM
+    # requests (clip pools, map-reduce), so those are limited per call instead
+    overrides = overrides or {}
+
+    def size(resource, default):
+        return overrides.get(resource) or config.get(f"batch_{resource}_concurrency", default)
+
+    stage_limits = {resource: asyncio.Semaphore(size(resource, default)) for resource, default in STAGE_LIMITS.items()}
+    call_limits = {resource: threading.BoundedSemaphore(size(resource, default)) for resource, default in CALL_LIMITS.items()}
+    return stage_limits, call_limits
+
+
+async def run_batch(items, config, max_files=4, limit_overrides=None, use_cache=True, force=False, resume=True):
+    limits, call_limits = make_limits(config, limit_overrides)
+    # Set before the per-file tasks are created, which copy this context
+    set_call_limits(call_limits)
+    file_slots = asyncio.Semaphore(max_files)
+    summary = {"completed": [], "failed": [], "skipped": [], "media_seconds": 0.0}
+
+    async def process(replicate_client, media_file, goals):
+        set_log_context(media=os.path.basename(media_file), goal=goals_label(goals))
+        if not force and is_completed(media_file, goals):
+            logger.info(f"Skipping {media_file}: {goals_label(goals)} output already exists")
+            summary["skipped"].append(media_file)
+            return
+        async with file_slots:
+            started = time.monotonic()
+            checkpoint = None
+            try:
+                media_hash = await asyncio.to_thread(hash_file, media_file)
+                checkpoint = open_checkpoint(
+                    get_checkpoint_path(media_file, goals),
+                    {"goal": goals_label(goals), "media_hash": media_hash, "use_cache": use_cache},
+                    # A forced run reprocesses from scratch instead of restoring the previous results
+                    resume and not force,
+                )
+                pipeline = build_media_pipeline(
+                    media_file,
+                    goals,
+                    config,
+                    media_hash,
+                    replicate_client,
+                    use_cache=use_cache,
+                    limits=limits,
+                    checkpoint=checkpoint,
+                )
+                results = await pipeline.run()
+            except Exception as e:
+                logger.error(f"Failed to process {media_file}: {str(e)}", exc_info=True)
+                summary["failed"].append(media_file)
+                if checkpoint is not None:
+                    checkpoint.mark("error")
+                return
+            checkpoint.mark("completed")
+            summary["completed"].append(media_file)
+            summary["media_seconds"] += results.get("media_info") or 0.0
+            logger.info(f"Processed {media_file} in {time.monotonic() - started:.1f}s")
+
+    from replicate_client import ReplicateClient  # httpx is only needed once files are processed
+
+    started = time.monotonic()
+    async with ReplicateClient(config) as replicate_client:
+        await asyncio.gather(*(process(replicate_client, media_file, goals) for media_file, goals in items))
+    summary["wall_seconds"] = time.monotonic() - started
+    return summary
+
+
+def format_summary(summary):
+    hours = max(summary["wall_seconds"], 1e-9) / 3600
+    completed = len(summary["completed"])
+    lines = [
+        f"Completed: {completed}  Failed: {len(summary['failed'])}  Skipped: {len(summary['skipped'])}",
+        f"Wall time: {summary['wall_seconds']:.1f}s",
+        f"Throughput: {completed / hours:.2f} files/hour, "
+        f"{summary['media_seconds'] / 3600 / hours:.2f} audio-hours/hour",
+    ]
+    lines += [f"  failed: {path}" for path in summary["failed"]]
+    return "\n".join(lines)
@@ -0,0 +1,172 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+from log import logger
+
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(__file__), '..', 'cache')
+
+
+def make_cache_key(*parts):
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class DiskCache:
+    """JSON values stored one file per key, evicted least-recently-used once max_bytes is exceeded."""
+
+    def __init__(self, directory, max_bytes, ttl_seconds=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key, suffix='.json'):
+        return os.path.join(self.directory, key[:2], f"{key}{suffix}")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        if self.ttl_seconds is not None and time.time() - entry["stored_at"] > self.ttl_seconds:
+            self.delete(key)
+            with self._lock:
+                self.misses += 1
+                self.expirations += 1
+            return None
+        # The file's mtime doubles as its last-access time for LRU eviction
+        os.utime(path)
+        with self._lock:
+            self.hits += 1
+        return entry["value"]
+
+    def set(self, key, value):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({"stored_at": time.time(), "value": value}, f)
+        os.replace(tmp_path, path)
+        self._evict()
+
+    def get_file(self, key, suffix):
+        path = self._path(key, suffix)
+        if not os.path.exists(path):
+            with self._lock:
+                self.misses += 1
+            return None
+        os.utime(path)
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def temp_file(self, key, suffix):
+        directory = os.path.dirname(self._path(key, suffix))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=f'.tmp{suffix}')
+        os.close(fd)
+        return tmp_path
+
+    def put_file(self, key, suffix, tmp_path):
+        path = self._path(key, suffix)
+        os.replace(tmp_path, path)
+        self._evict(keep=path)
+        return path
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _entries(self):
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if '.tmp' in name:
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _evict(self, keep=None):
+        with self._lock:
+            entries = self._entries()
+            total = sum(size for _, size, _ in entries)
+            if total <= self.max_bytes:
+                return
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                total -= size
+                self.evictions += 1
+                logger.debug(f"Evicted cache entry {path}")
+
+    def stats(self):
+        entries = self._entries()
+        return {
+            "directory": self.directory,
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(config, name, default_max_bytes, default_ttl_seconds=None):
+    directory = os.path.join(config.get('cache_dir') or DEFAULT_CACHE_DIR, name)
+    max_bytes = config.get(f'{name}_cache_max_bytes', default_max_bytes)
+    ttl_seconds = config.get(f'{name}_cache_ttl_seconds', default_ttl_seconds)
+    with _caches_lock:
+        cache = _caches.get(directory)
+        if cache is None:
+            cache = DiskCache(directory, max_bytes, ttl_seconds)
+            _caches[directory] = cache
+        return cache
+
+
+def transcript_cache(config):
+    return get_cache(config, 'transcript', 512 * 1024 * 1024)
+
+
+def llm_cache(config):
+    return get_cache(config, 'llm', 128 * 1024 * 1024, 7 * 24 * 3600)
+
+
+def audio_cache(config):
+    return get_cache(config, 'audio', 2 * 1024 * 1024 * 1024)
+
+
+def keyframes_cache(config):
+    return get_cache(config, 'keyframes', 64 * 1024 * 1024)
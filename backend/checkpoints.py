@@ -0,0 +1,84 @@
+import json
+import os
+import tempfile
+import threading
+import time
+
+from log import logger
+
+
+class Checkpoint:
+    """Per-job manifest of completed stage results, persisted as JSON after every stage."""
+
+    def __init__(self, path, metadata=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self.data = {"metadata": metadata or {}, "status": "running", "stages": {}}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    stored = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable checkpoint {path}: {str(e)}")
+                stored = None
+            # A checkpoint for different media or settings cannot be resumed. Neither can a
+            # finished run: its stage results point at clip files and outputs that may be gone.
+            # Without metadata the checkpoint is only being inspected and is always loaded
+            if stored is None:
+                pass
+            elif metadata is not None and stored.get("metadata") != metadata:
+                logger.info(f"Discarding checkpoint {path}: job parameters changed")
+            elif metadata is not None and stored.get("status") == "completed":
+                logger.info(f"Discarding checkpoint {path}: the previous run completed")
+            else:
+                self.data = stored
+                logger.info(f"Loaded checkpoint {path} with stages: {', '.join(self.data['stages']) or 'none'}")
+
+    @classmethod
+    def load(cls, path):
+        checkpoint = cls(path)
+        return checkpoint if checkpoint.data["stages"] or checkpoint.data["metadata"] else None
+
+    @property
+    def metadata(self):
+        return self.data["metadata"]
+
+    @property
+    def status(self):
+        return self.data["status"]
+
+    def has(self, name):
+        return name in self.data["stages"]
+
+    def result(self, name):
+        return self.data["stages"][name]["result"]
+
+    def save_stage(self, name, result):
+        with self._lock:
+            self.data["stages"][name] = {"result": result, "completed_at": time.time()}
+            self._write()
+
+    def discard_stage(self, name):
+        with self._lock:
+            if self.data["stages"].pop(name, None) is not None:
+                self._write()
+
+    def mark(self, status):
+        with self._lock:
+            self.data["status"] = status
+            self._write()
+
+    def _write(self):
+        directory = os.path.dirname(self.path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.data, f)
+        os.replace(tmp_path, self.path)
+
+
+def open_checkpoint(path, metadata, resume=True):
+    if not resume and os.path.exists(path):
+        os.remove(path)
+        logger.info(f"Removed checkpoint {path} to start over")
+    return Checkpoint(path, metadata)
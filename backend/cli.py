@@ -1,101 +1,156 @@
+import argparse
+import asyncio
 import os
-import subprocess
 
 
-from ai_jobs import (
-    create_media_clips,
-    generate_content,
-    get_transcription_result,
-    start_transcription,
-)
-from s3 import get_s3_presigned_url, upload_to_s3
-from log import logger, save_debug_info
-from transcription_goal import TranscriptionGoal
-from utils import load_config, prompt_for_goal, prompt_for_media_file
-
-
-# Generate FFmpeg commands
-def execute_ffmpeg_commands(commands):
-    logger.debug(f"Executing FFmpeg commands: {commands}")
-    for command in commands.split("&&"):
-        logger.debug(f"Executing command: {command.strip()}")
-        subprocess.run(command.strip(), shell=True, check=True)
-    logger.info("All FFmpeg commands executed successfully")
+from batch import expand_inputs, format_summary, load_manifest, run_batch
+from log import logger, set_log_context
+from checkpoints import open_checkpoint
+from pipeline import build_media_pipeline, get_checkpoint_path
+from transcription_goal import TranscriptionGoal, goals_label, parse_goals
+from services import services
+from utils import hash_file, prompt_for_goals, prompt_for_media_file
+
+
+async def process_file(media_file, goals, config, progress_callback=None, use_cache=True, resume=True):
+    goals = parse_goals(goals)
+    set_log_context(media=os.path.basename(media_file), goal=goals_label(goals))
+    media_hash = await asyncio.to_thread(hash_file, media_file)
+    checkpoint = open_checkpoint(
+        get_checkpoint_path(media_file, goals),
+        {"goal": goals_label(goals), "media_hash": media_hash, "use_cache": use_cache},
+        resume,
+    )
+    from replicate_client import ReplicateClient  # httpx is only needed once a file is processed
+
+    async with ReplicateClient(config) as replicate_client:
+        pipeline = build_media_pipeline(
+            media_file,
+            goals,
+            config,
+            media_hash,
+            replicate_client,
+            use_cache=use_cache,
+            progress_callback=progress_callback,
+            checkpoint=checkpoint,
+        )
+        try:
+            await pipeline.run()
+        except BaseException:
+            checkpoint.mark("error")
+            raise
+        checkpoint.mark("completed")
+    return pipeline
 
 
 def main(
-    media_file, goal=TranscriptionGoal.GENERAL_TRANSCRIPTION, progress_callback=None
+    media_file,
+    goals=TranscriptionGoal.GENERAL_TRANSCRIPTION,
+    progress_callback=None,
+    use_cache=True,
+    resume=True,
 ):
     try:
         logger.info(f"Starting main process for file: {media_file}")
         if progress_callback:
             progress_callback("Starting transcription process", 0)
 
-        config = load_config()
-        logger.debug(f"Loaded configuration: {config}")
-
-        if progress_callback:
-            progress_callback("Uploading media to S3", 10)
-        upload_to_s3(media_file, config)
-
-        if progress_callback:
-            progress_callback("Getting presigned URL", 20)
-        presigned_url = get_s3_presigned_url(os.path.basename(media_file), config)
-
-        if progress_callback:
-            progress_callback("Starting transcription", 30)
-        prediction = start_transcription(presigned_url, config)
-
-        if progress_callback:
-            progress_callback("Processing transcription", 40)
-        transcript = get_transcription_result(prediction["urls"]["get"], config)
-
-        if progress_callback:
-            progress_callback(f"Generating {goal.value.replace('_', ' ')}", 60)
-        content = generate_content(transcript, goal, config)
-
-        output_name = os.path.splitext(os.path.basename(media_file))[0]
-        output_folder = os.path.join(os.path.dirname(media_file), output_name)
-        os.makedirs(output_folder, exist_ok=True)
-        
-        transcription_file = os.path.join(output_folder, f"{output_name}_transcription.txt")
-        with open(transcription_file, 'w') as f:
-            for segment in transcript:
-                f.write(f"{segment['start']} - {segment['end']}: {segment['text']}\n")
-        logger.info(f"Transcription saved to {transcription_file}")
-
-        output_file = os.path.join(output_folder, f"{output_name}_{goal.value}.md")
-        logger.info(f"Writing content to file: {output_file}")
-        with open(output_file, "w") as f:
-            f.write(content)
-
-        if progress_callback:
-            progress_callback("Creating media clips", 80)
-        ffmpeg_commands, topics, clips = create_media_clips(
-            transcript, content, media_file, output_folder, goal, config
-        )
-
-        # Save debug information
-        save_debug_info(output_folder, content, topics, clips)
+        config = services.config
+        logger.debug(f"Loaded configuration with {len(config)} settings")
 
-        execute_ffmpeg_commands(ffmpeg_commands)
+        pipeline = asyncio.run(process_file(media_file, goals, config, progress_callback, use_cache, resume))
 
         if progress_callback:
             progress_callback("Process complete", 100)
 
         logger.info("Main process completed successfully")
+        return pipeline
     except Exception as e:
         logger.error(f"An error occurred: {str(e)}", exc_info=True)
         raise
 
 
+def run_batch_command(args):
+    config = services.config
+    default_goals = parse_goals(args.goal)
+    items = [(path, default_goals) for path in expand_inputs(args.inputs, args.recursive)]
+    if args.manifest:
+        items += load_manifest(args.manifest, default_goals)
+    if not items:
+        logger.warning("No media files found for batch processing. Exiting.")
+        return
+
+    logger.info(f"Batch processing {len(items)} files")
+    summary = asyncio.run(run_batch(
+        items,
+        config,
+        max_files=args.jobs,
+        limit_overrides={
+            "upload": args.upload_concurrency,
+            "transcription": args.transcription_concurrency,
+            "llm": args.llm_concurrency,
+            "ffmpeg": args.ffmpeg_concurrency,
+        },
+        use_cache=not args.no_cache,
+        force=args.force,
+        resume=not args.restart,
+    ))
+    report = format_summary(summary)
+    logger.info(f"Batch summary:\n{report}")
+    print(report)
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Transcribe, summarize and clip a media file")
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Ignore cached transcripts and LLM responses and recompute everything",
+    )
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="Ignore the checkpoint of a previous interrupted or failed run and start over",
+    )
+    subparsers = parser.add_subparsers(dest="command")
+    batch_parser = subparsers.add_parser(
+        "batch",
+        help="Process many media files non-interactively",
+        description="Process directories, glob patterns or a manifest of media files concurrently",
+    )
+    batch_parser.add_argument("inputs", nargs="*", help="Media files, directories or glob patterns")
+    batch_parser.add_argument(
+        "--manifest",
+        help="CSV (path[,goal+goal]) or JSON list of {file, goals} entries",
+    )
+    batch_parser.add_argument(
+        "--goal",
+        nargs="+",
+        default=[TranscriptionGoal.GENERAL_TRANSCRIPTION.value],
+        choices=[goal.value for goal in TranscriptionGoal],
+        help="Goals for inputs without any in the manifest; several share one transcription",
+    )
+    batch_parser.add_argument("--recursive", action="store_true", help="Search directories recursively")
+    batch_parser.add_argument("--jobs", type=int, default=4, help="Files processed at the same time")
+    batch_parser.add_argument("--upload-concurrency", type=int, help="Concurrent S3 uploads")
+    batch_parser.add_argument("--transcription-concurrency", type=int, help="Concurrent transcriptions")
+    batch_parser.add_argument("--llm-concurrency", type=int, help="Concurrent LLM requests")
+    batch_parser.add_argument("--ffmpeg-concurrency", type=int, help="Concurrent ffmpeg and ffprobe processes")
+    batch_parser.add_argument("--force", action="store_true", help="Reprocess files that already have outputs")
+    batch_parser.add_argument("--no-cache", action="store_true", default=argparse.SUPPRESS)
+    batch_parser.add_argument("--restart", action="store_true", default=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.command == "batch":
+        run_batch_command(args)
+        raise SystemExit(0)
+
     logger.info("Script started")
     media_file = prompt_for_media_file()
     if media_file:
         logger.info(f"Media file selected: {media_file}")
-        goal = prompt_for_goal()
-        logger.info(f"Transcription goal selected: {goal.value}")
-        main(media_file, goal)
+        goals = prompt_for_goals()
+        logger.info(f"Transcription goals selected: {goals_label(goals)}")
+        main(media_file, goals, use_cache=not args.no_cache, resume=not args.restart)
     else:
         logger.warning("No media file selected. Exiting.")
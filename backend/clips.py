@@ -0,0 +1,221 @@
+import math
+import os
+import shutil
+import subprocess
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from limits import resource_slot
+from log import logger, propagate_context
+from metrics import FFMPEG_OUTPUT_BYTES, FFMPEG_RETRIES, FFMPEG_SECONDS
+
+
+def get_ffmpeg_path(config):
+    return config.get('ffmpeg_path') or shutil.which('ffmpeg') or 'ffmpeg'
+
+
+def get_ffprobe_path(config):
+    return config.get('ffprobe_path') or shutil.which('ffprobe') or 'ffprobe'
+
+
+def probe_duration(media_file, config):
+    command = [
+        get_ffprobe_path(config),
+        "-v", "error",
+        "-show_entries", "format=duration",
+        "-of", "default=noprint_wrappers=1:nokey=1",
+        media_file,
+    ]
+    try:
+        with resource_slot("ffmpeg"), FFMPEG_SECONDS.time(operation="probe"):
+            result = subprocess.run(command, capture_output=True, text=True, check=True)
+        return float(result.stdout.strip())
+    except (subprocess.CalledProcessError, OSError, ValueError) as e:
+        logger.warning(f"Could not determine duration of {media_file}: {str(e)}")
+        return None
+
+
+def safe_clip_title(title):
+    safe_title = ''.join(c for c in title if c.isalnum() or c in (' ', '_')).rstrip()
+    return safe_title.replace(' ', '_') or 'clip'
+
+
+def build_clip_specs(clips, source_file, dest_folder, buffer=0.5, duration=None):
+    extension = os.path.splitext(source_file)[1]
+    specs = []
+    used_names = set()
+    for clip in clips:
+        name = safe_clip_title(clip['title'])
+        # Topics with the same title would otherwise overwrite each other's clip
+        candidate, suffix = name, 2
+        while candidate in used_names:
+            candidate = f"{name}_{suffix}"
+            suffix += 1
+        used_names.add(candidate)
+        specs.append({
+            "title": clip['title'],
+            "start": max(0, float(clip['start']) - buffer),
+            "end": min(float(clip['end']) + buffer, duration) if duration else float(clip['end']) + buffer,
+            "output_file": os.path.join(dest_folder, f"{candidate}{extension}"),
+        })
+    return specs
+
+
+def format_seek(spec):
+    if spec.get('keyframe_aligned'):
+        # Rounded up to the millisecond: a seek even slightly before the keyframe
+        # would make the stream copy start at the previous one
+        return f"{math.ceil(spec['start'] * 1000 - 1e-6) / 1000:.3f}"
+    return f"{spec['start']:.2f}"
+
+
+def build_ffmpeg_command(spec, source_file, ffmpeg_path):
+    # -ss before -i seeks the input directly instead of decoding up to the start
+    # time. A stream copy starts on a keyframe; clips without one near their
+    # start are re-encoded, which decodes only from the preceding keyframe
+    codec = ["-c:v", "libx264", "-preset", "veryfast", "-crf", "20", "-c:a", "aac"] if spec.get('reencode') else ["-c", "copy"]
+    return [
+        ffmpeg_path,
+        "-hide_banner",
+        "-loglevel", "error",
+        "-ss", format_seek(spec),
+        "-i", source_file,
+        "-t", f"{spec['end'] - spec['start']:.2f}",
+        *codec,
+        "-avoid_negative_ts", "make_zero",
+        "-y",
+        spec['output_file'],
+    ]
+
+
+def extract_clip(spec, source_file, ffmpeg_path, retries=1):
+    command = build_ffmpeg_command(spec, source_file, ffmpeg_path)
+    seconds = 0.0
+    error = None
+    attempts = 0
+    while attempts <= retries:
+        attempts += 1
+        logger.debug("Executing command: %s", command)
+        with resource_slot("ffmpeg"):
+            started = time.monotonic()
+            result = subprocess.run(command, capture_output=True, text=True)
+            seconds += time.monotonic() - started
+        if result.returncode == 0:
+            error = None
+            break
+        error = result.stderr.strip() or f"ffmpeg exited with code {result.returncode}"
+        logger.warning(f"Clip '{spec['title']}' failed on attempt {attempts}: {error}")
+
+    operation = "clip_reencode" if spec.get('reencode') else "clip"
+    FFMPEG_SECONDS.observe(seconds, operation=operation)
+    if attempts > 1:
+        FFMPEG_RETRIES.inc(attempts - 1, operation=operation)
+    if error is None:
+        logger.info(f"Clip '{spec['title']}' extracted in {seconds:.2f}s")
+        FFMPEG_OUTPUT_BYTES.observe(os.path.getsize(spec['output_file']), operation=operation)
+    return {
+        "title": spec['title'],
+        "output_file": spec['output_file'],
+        "start": spec['start'],
+        "end": spec['end'],
+        "reencoded": bool(spec.get('reencode')),
+        "seconds": round(seconds, 3),
+        "attempts": attempts,
+        "error": error,
+    }
+
+
+def extract_clips(specs, source_file, config):
+    # Each clip runs in its own ffmpeg process; the pool bounds how many run at once
+    max_workers = config.get('clip_workers') or os.cpu_count() or 1
+    retries = config.get('clip_retries', 1)
+    ffmpeg_path = get_ffmpeg_path(config)
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(
+            propagate_context(lambda spec: extract_clip(spec, source_file, ffmpeg_path, retries)),
+            specs,
+        ))
+
+    failed = [r for r in results if r['error']]
+    logger.info(
+        f"Extracted {len(results) - len(failed)}/{len(results)} clips in "
+        f"{time.monotonic() - started:.2f}s using {max_workers} workers"
+    )
+    for result in failed:
+        logger.error(f"Clip '{result['title']}' failed: {result['error']}")
+    return results
+
+
+def clip_range_key(spec):
+    # ffmpeg is given times at centisecond precision, so equal keys cut identical files
+    return round(spec['start'], 2), round(spec['end'], 2)
+
+
+def link_clip(source, destination):
+    if os.path.exists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+class ClipCutter:
+    """Cuts the clips of one source file as each goal's clip specs arrive.
+
+    A range requested more than once, within one call or by an earlier or
+    concurrent call for another goal, is cut once and linked to the other
+    output names. Results keep the order of the specs passed in.
+    """
+
+    def __init__(self, source_file, config):
+        self.source_file = source_file
+        self.config = config
+        self._lock = threading.Lock()
+        # Range key -> Future holding the result of the one cut of that range
+        self._cuts = {}
+
+    def extract(self, specs):
+        owned = {}
+        with self._lock:
+            for spec in specs:
+                key = clip_range_key(spec)
+                if key not in self._cuts:
+                    self._cuts[key] = Future()
+                    owned[key] = spec
+        if len(owned) < len(specs):
+            logger.info(f"Cutting {len(owned)} new ranges for {len(specs)} clips")
+        try:
+            cut = extract_clips(list(owned.values()), self.source_file, self.config)
+        except BaseException as e:
+            for key in owned:
+                self._cuts[key].set_exception(e)
+            raise
+        for key, result in zip(owned, cut):
+            self._cuts[key].set_result(result)
+
+        results = []
+        for spec in specs:
+            result = self._cuts[clip_range_key(spec)].result()
+            if result['output_file'] != spec['output_file']:
+                if result['error'] is None:
+                    link_clip(result['output_file'], spec['output_file'])
+                result = {
+                    **result,
+                    "title": spec['title'],
+                    "output_file": spec['output_file'],
+                    "seconds": 0.0,
+                    "attempts": 0,
+                    "shared_with": result['output_file'],
+                }
+            results.append(result)
+        return results
+
+
+def check_clip_results(results):
+    failed = [r for r in results if r['error']]
+    if results and len(failed) == len(results):
+        raise RuntimeError(f"All {len(results)} clips failed to extract: {failed[0]['error']}")
+    return failed
@@ -0,0 +1,239 @@
+import asyncio
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import deque
+
+from log import logger
+from metrics import CANCELLED_JOBS, COMPLETED_JOBS, FAILED_JOBS, JOB_SECONDS, REJECTED_JOBS
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, goals, job_id=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.goals = goals
+        self.media_file = None
+        self.media_hash = None
+        self.media_size = 0
+        self.use_cache = True
+        self.work_dir = None
+        self.output_folder = None
+        self.package = None
+        # Shared by everything that writes the job's checkpoint file, so no writer overwrites another
+        self.checkpoint = None
+        self.timings = {}
+        self.status = "queued"
+        self.progress = 0
+        self.message = "Waiting in queue"
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+        self.finished_at = None
+        self.task = None
+        self.cancel_requested = False
+        # Content generated so far per goal, replayed to clients that subscribe late
+        self.content = {}
+        self._subscribers = {}
+        self._events_lock = threading.Lock()
+
+    def update(self, status, progress, message):
+        self.status = status
+        self.progress = progress
+        self.message = message
+        logger.info(f"Job {self.id} - Status Update: {status} - Progress: {progress}% - Message: {message}")
+        self.publish("status", self.status_event())
+
+    def status_event(self):
+        return {"status": self.status, "progress": self.progress, "message": self.message}
+
+    def publish(self, event, data):
+        # Safe to call from worker threads: events are handed to each subscriber's event loop
+        with self._events_lock:
+            if event == "content_start":
+                self.content[data["goal"]] = ""
+            elif event == "content":
+                self.content[data["goal"]] = self.content.get(data["goal"], "") + data["text"]
+            for queue, loop in self._subscribers.items():
+                loop.call_soon_threadsafe(queue.put_nowait, (event, data))
+
+    def subscribe(self):
+        # Must be called from the event loop. The queue starts with the content so
+        # far and the current status, and no event is missed or repeated after them.
+        queue = asyncio.Queue()
+        with self._events_lock:
+            for goal, text in self.content.items():
+                queue.put_nowait(("content_start", {"goal": goal}))
+                queue.put_nowait(("content", {"goal": goal, "text": text}))
+            queue.put_nowait(("status", self.status_event()))
+            self._subscribers[queue] = asyncio.get_running_loop()
+        return queue
+
+    def unsubscribe(self, queue):
+        with self._events_lock:
+            self._subscribers.pop(queue, None)
+
+    @property
+    def finished(self):
+        return self.status in ("completed", "error", "cancelled")
+
+
+class JobManager:
+    """Registry of jobs plus a bounded admission queue drained by a fixed worker pool."""
+
+    def __init__(self, handler, max_workers=2, max_queued=8, retention_seconds=3600):
+        self.handler = handler
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.retention_seconds = retention_seconds
+        self.jobs = {}
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.cancelled = 0
+        self._queue = None
+        self._workers = []
+        self._wait_times = deque(maxlen=1000)
+
+    @property
+    def running(self):
+        return bool(self._workers)
+
+    def start(self):
+        self._queue = asyncio.Queue(maxsize=self.max_queued)
+        self._workers = [asyncio.create_task(self._worker(i)) for i in range(self.max_workers)]
+        logger.info(f"Job manager started with {self.max_workers} workers and queue size {self.max_queued}")
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        logger.info("Job manager stopped")
+
+    def is_full(self):
+        return self._queue is not None and self._queue.full()
+
+    def submit(self, job):
+        if not self.running:
+            raise RuntimeError("Job manager is not running")
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.record_rejection()
+            raise QueueFullError(f"Job queue is full ({self.max_queued} jobs waiting)")
+        self.jobs[job.id] = job
+        logger.info(f"Job {job.id} queued (queue depth: {self._queue.qsize()})")
+        return job
+
+    def record_rejection(self):
+        self.rejected += 1
+        REJECTED_JOBS.inc()
+
+    def register(self, job):
+        self.jobs[job.id] = job
+        return job
+
+    def retry(self, job):
+        job.cancel_requested = False
+        job.submitted_at = time.monotonic()
+        job.finished_at = None
+        job.update("queued", 0, "Waiting in queue")
+        try:
+            return self.submit(job)
+        except QueueFullError:
+            job.update("error", 0, "Retry rejected: job queue is full")
+            job.finished_at = time.monotonic()
+            raise
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def cancel(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None or job.finished:
+            return False
+        job.cancel_requested = True
+        if job.task is not None:
+            job.task.cancel()
+        else:
+            # Still queued: the worker skips it when dequeued
+            job.update("cancelled", 0, "Cancelled before processing started")
+            job.finished_at = time.monotonic()
+            self.cancelled += 1
+            CANCELLED_JOBS.inc()
+        return True
+
+    async def _worker(self, worker_id):
+        while True:
+            job = await self._queue.get()
+            if job.cancel_requested:
+                self._queue.task_done()
+                continue
+            job.started_at = time.monotonic()
+            self._wait_times.append(job.started_at - job.submitted_at)
+            self.active += 1
+            logger.info(f"Worker {worker_id} picked up job {job.id} after {job.started_at - job.submitted_at:.2f}s in queue")
+            job.task = asyncio.create_task(self.handler(job))
+            try:
+                await job.task
+            except asyncio.CancelledError:
+                if not job.cancel_requested:
+                    job.task.cancel()
+                    raise
+                job.update("cancelled", job.progress, "Cancelled")
+            except Exception as e:
+                logger.error(f"Unhandled error in job {job.id}: {str(e)}", exc_info=True)
+                job.update("error", 0, f"Error: {str(e)}")
+            finally:
+                job.finished_at = time.monotonic()
+                job.task = None
+                self.active -= 1
+                JOB_SECONDS.observe(job.finished_at - job.started_at, status=job.status)
+                if job.status == "completed":
+                    self.completed += 1
+                    COMPLETED_JOBS.inc()
+                elif job.status == "cancelled":
+                    self.cancelled += 1
+                    CANCELLED_JOBS.inc()
+                else:
+                    self.failed += 1
+                    FAILED_JOBS.inc()
+                self._queue.task_done()
+                self._prune()
+
+    def _prune(self):
+        now = time.monotonic()
+        expired = [
+            job for job in self.jobs.values()
+            if job.finished and now - job.finished_at > self.retention_seconds
+        ]
+        for job in expired:
+            del self.jobs[job.id]
+            if job.work_dir and os.path.isdir(job.work_dir):
+                shutil.rmtree(job.work_dir, ignore_errors=True)
+            logger.info(f"Job {job.id} expired and was removed from the registry")
+
+    def metrics(self):
+        wait_times = sorted(self._wait_times)
+        return {
+            "workers": self.max_workers,
+            "active_jobs": self.active,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "queue_capacity": self.max_queued,
+            "completed_jobs": self.completed,
+            "failed_jobs": self.failed,
+            "rejected_jobs": self.rejected,
+            "cancelled_jobs": self.cancelled,
+            "queue_wait_seconds": {
+                "count": len(wait_times),
+                "avg": sum(wait_times) / len(wait_times) if wait_times else 0.0,
+                "p95": wait_times[int(0.95 * (len(wait_times) - 1))] if wait_times else 0.0,
+                "max": wait_times[-1] if wait_times else 0.0,
+            },
+        }
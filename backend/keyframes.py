@@ -0,0 +1,106 @@
+import bisect
+import json
+import subprocess
+
+from cache import keyframes_cache, make_cache_key
+from clips import get_ffprobe_path
+from limits import resource_slot
+from log import logger
+from metrics import FFMPEG_SECONDS
+
+
+def probe_keyframes(media_file, config):
+    # Reads packet flags without decoding anything, so this costs one pass of
+    # demuxing. "V" skips cover art, which would otherwise count as a video stream
+    command = [
+        get_ffprobe_path(config),
+        "-v", "error",
+        "-select_streams", "V:0",
+        "-show_entries", "packet=pts_time,flags:format=start_time",
+        "-of", "json",
+        media_file,
+    ]
+    with resource_slot("ffmpeg"), FFMPEG_SECONDS.time(operation="keyframes"):
+        result = subprocess.run(command, capture_output=True, text=True, check=True)
+    probe = json.loads(result.stdout or "{}")
+    # Packet times are absolute, but an input -ss is relative to the container's
+    # start time, which is non-zero for MPEG-TS and for MOV files with edit lists
+    try:
+        start_time = float(probe.get("format", {}).get("start_time", 0))
+    except ValueError:
+        start_time = 0.0
+    keyframes = []
+    for packet in probe.get("packets", []):
+        if "K" not in packet.get("flags", ""):
+            continue
+        try:
+            keyframes.append(max(float(packet["pts_time"]) - start_time, 0.0))
+        except (KeyError, ValueError):
+            continue
+    return sorted(set(keyframes))
+
+
+def load_keyframe_index(media_file, media_hash, config):
+    """Keyframe times of the media's first video stream, probed once and cached.
+
+    Returns an empty list for audio-only media, where every frame can start a
+    clip, and None when the media could not be probed.
+    """
+    cache_key = make_cache_key("keyframes", media_hash)
+    try:
+        cache = keyframes_cache(config)
+        keyframes = cache.get(cache_key)
+    except OSError as e:
+        logger.warning(f"Keyframe cache unavailable: {str(e)}")
+        cache = keyframes = None
+    if keyframes is not None:
+        logger.info(f"Loaded {len(keyframes)} keyframes of {media_file} from cache")
+        return keyframes
+
+    try:
+        keyframes = probe_keyframes(media_file, config)
+    except (subprocess.CalledProcessError, OSError, ValueError) as e:
+        logger.warning(f"Could not index keyframes of {media_file}: {str(e)}")
+        return None
+    logger.info(f"Indexed {len(keyframes)} keyframes of {media_file}")
+    # The index only saves a probe next time, so failing to store it is not an error
+    if cache is not None:
+        try:
+            cache.set(cache_key, keyframes)
+        except OSError as e:
+            logger.warning(f"Could not cache keyframe index of {media_file}: {str(e)}")
+    return keyframes
+
+
+def snap_to_keyframe(start, keyframes, tolerance):
+    # A stream copy can only start on a keyframe. The one at or before `start`
+    # is preferred so no content is lost, then the next one; None if neither is
+    # within the tolerance
+    position = bisect.bisect_right(keyframes, start)
+    if position and start - keyframes[position - 1] <= tolerance:
+        return keyframes[position - 1]
+    if position < len(keyframes) and keyframes[position] - start <= tolerance:
+        return keyframes[position]
+    return None
+
+
+def align_clip_specs(specs, keyframes, config):
+    """Move each clip's start onto a keyframe so it can be cut with a stream copy.
+
+    Clips with no keyframe within `clip_keyframe_tolerance` seconds are marked
+    for re-encoding when `clip_reencode_unaligned` is set, and otherwise left
+    to ffmpeg, which starts the copy at the preceding keyframe.
+    """
+    if not keyframes:
+        return specs
+    tolerance = config.get('clip_keyframe_tolerance', 2.0)
+    reencode = config.get('clip_reencode_unaligned', True)
+    aligned = []
+    for spec in specs:
+        keyframe = snap_to_keyframe(spec['start'], keyframes, tolerance)
+        if keyframe is not None and keyframe < spec['end']:
+            aligned.append({**spec, "start": keyframe, "keyframe_aligned": True})
+        else:
+            logger.debug(f"No keyframe within {tolerance}s of {spec['start']:.2f}s for clip '{spec['title']}'")
+            aligned.append({**spec, "reencode": reencode})
+    return aligned
@@ -0,0 +1,24 @@
+import contextvars
+from contextlib import contextmanager
+
+
+# Per-call limits shared by every pipeline of a batch, e.g. {"ffmpeg": BoundedSemaphore(2)}.
+# Context variables reach asyncio.to_thread and propagate_context workers, so
+# calls deep inside a stage's thread pool see the limits of the batch that started it
+call_limits = contextvars.ContextVar('call_limits', default={})
+
+
+def set_call_limits(limits):
+    call_limits.set(limits)
+
+
+@contextmanager
+def resource_slot(resource):
+    # Held around a single ffmpeg/ffprobe process or API request; a no-op
+    # unless a limit for `resource` was set in the current context
+    limit = call_limits.get().get(resource)
+    if limit is None:
+        yield
+        return
+    with limit:
+        yield
@@ -0,0 +1,147 @@
+import json
+import math
+import re
+
+
+FENCE_PATTERN = re.compile(r"```(?:json)?[ \t]*\n?(.*?)```", re.DOTALL)
+TIMESTAMP_PATTERN = re.compile(r"^(?:(\d+):)?(\d{1,2}):(\d{1,2}(?:\.\d+)?)$")
+WORD_PATTERN = re.compile(r"\w+")
+
+MAX_KEYWORDS = 5
+MIN_CLIP_SECONDS = 1.0
+
+_decoder = json.JSONDecoder()
+
+
+def extract_json_items(text):
+    """Return the objects of the JSON array in a model response.
+
+    The array may be wrapped in a code fence or in prose. When it does not
+    parse as a whole, because the output was cut off at max_tokens or one
+    entry is malformed, every complete object in it is still recovered.
+    """
+    for block in FENCE_PATTERN.findall(text) + [text]:
+        items = parse_array(block)
+        if items:
+            return items
+    return []
+
+
+def parse_array(text):
+    position = text.find("[")
+    while position != -1:
+        try:
+            value, _ = _decoder.raw_decode(text, position)
+        except json.JSONDecodeError:
+            break
+        items = [item for item in value if isinstance(item, dict)] if isinstance(value, list) else []
+        if items:
+            return items
+        position = text.find("[", position + 1)
+
+    # Incremental fallback: decode object by object, skipping over whatever does not parse
+    items = []
+    position = text.find("{", max(position, 0))
+    while position != -1:
+        try:
+            value, end = _decoder.raw_decode(text, position)
+        except json.JSONDecodeError:
+            position = text.find("{", position + 1)
+            continue
+        if isinstance(value, dict):
+            items.append(value)
+        position = text.find("{", end)
+    return items
+
+
+def parse_seconds(value):
+    # Seconds as a number or numeric string, or an "mm:ss" / "hh:mm:ss" timestamp.
+    # NaN and infinities compare false against every bound, so they are rejected here
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value) if math.isfinite(value) else None
+    if not isinstance(value, str):
+        return None
+    value = value.strip().rstrip("s")
+    try:
+        seconds = float(value)
+        return seconds if math.isfinite(seconds) else None
+    except ValueError:
+        pass
+    match = TIMESTAMP_PATTERN.match(value)
+    if match is None:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours or 0) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def normalize_title(title):
+    return " ".join(title.split()) if isinstance(title, str) else ""
+
+
+def validate_topics(items):
+    # Topics need a title; missing or malformed keywords fall back to the
+    # title's words, since retrieval only needs something to search for
+    topics = []
+    seen = set()
+    for item in items:
+        title = normalize_title(item.get("title"))
+        if not title or title.lower() in seen:
+            continue
+        seen.add(title.lower())
+        keywords = item.get("keywords")
+        if isinstance(keywords, str):
+            keywords = keywords.split(",")
+        if not isinstance(keywords, list):
+            keywords = []
+        keywords = [keyword.strip() for keyword in keywords if isinstance(keyword, str) and keyword.strip()]
+        if not keywords:
+            keywords = [word for word in WORD_PATTERN.findall(title) if len(word) > 2] or [title]
+        topics.append({"title": title, "keywords": keywords[:MAX_KEYWORDS]})
+    return topics
+
+
+def merge_ranges(ranges):
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def validate_clips(items, topics, bounds):
+    """Check clips against the topics and the transcript's time bounds.
+
+    Times are clamped to `bounds`, swapped start and end are put right, and
+    overlapping clips of the same topic are merged. Returns the valid clips in
+    topic order and the topics left without a valid clip.
+    """
+    first, last = bounds
+    titles = {normalize_title(topic["title"]).lower(): topic["title"] for topic in topics}
+    ranges = {}
+    for index, item in enumerate(items):
+        key = normalize_title(item.get("title")).lower()
+        if key not in titles:
+            # A model that rewords every title still answers the topics in order
+            if len(items) != len(topics):
+                continue
+            key = normalize_title(topics[index]["title"]).lower()
+        start, end = parse_seconds(item.get("start")), parse_seconds(item.get("end"))
+        if start is None or end is None:
+            continue
+        start, end = min(start, end), max(start, end)
+        start, end = max(start, first), min(end, last)
+        if end - start < MIN_CLIP_SECONDS:
+            continue
+        ranges.setdefault(titles[key], []).append((start, end))
+
+    clips = [
+        {"title": topic["title"], "start": start, "end": end}
+        for topic in topics
+        for start, end in merge_ranges(ranges.get(topic["title"], []))
+    ]
+    missing = [topic for topic in topics if topic["title"] not in ranges]
+    return clips, missing
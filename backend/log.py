@@ -1,22 +1,202 @@
+import atexit
+import contextvars
 import logging
+import logging.handlers
+import queue
+import random
+import threading
+from contextlib import contextmanager
 from logging.handlers import RotatingFileHandler
 import os
 import json
 
 
-# Set up logging
-logging.basicConfig(level=logging.INFO,
-                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-                    handlers=[
-                        RotatingFileHandler('debug.log', maxBytes=10000000, backupCount=5),
-                        logging.StreamHandler()
-                    ])
-logging.getLogger('multipart').setLevel(logging.WARNING)
+LOG_PROFILES = {
+    # development: everything at DEBUG, with payloads capped; production: INFO and up,
+    # JSON lines in the log file, warnings only on the console and no payloads
+    "development": {
+        "level": "DEBUG",
+        "console_level": "DEBUG",
+        "format": "text",
+        "payload_max_chars": 2000,
+        "payload_sample_rate": 1.0,
+    },
+    "production": {
+        "level": "INFO",
+        "console_level": "WARNING",
+        "format": "json",
+        "payload_max_chars": 0,
+        "payload_sample_rate": 0.0,
+    },
+}
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(context)s%(message)s'
+
+# Fields such as job_id, goal and stage attached to every record logged in this context
+log_context = contextvars.ContextVar('log_context', default={})
+
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
+settings = dict(LOG_PROFILES["development"])
+_listener = None
+_queue_handler = None
+_configure_lock = threading.Lock()
+
+
+class ContextFilter(logging.Filter):
+    # Runs in the calling thread before the record is queued, so the caller's context is current
+    def filter(self, record):
+        context = log_context.get()
+        record.context_fields = context
+        record.context = "".join(f"[{key}={value}] " for key, value in context.items())
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **getattr(record, "context_fields", {}),
+        }
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # Formats the message in the caller but leaves the output format to the
+        # listener thread; unlike the stdlib version it keeps exc_info and the
+        # context fields so each handler can render them
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+
+class Payload:
+    """Defers reading and truncating a large payload until a record is actually emitted."""
+
+    def __init__(self, value, max_chars):
+        self.value = value
+        self.max_chars = max_chars
+
+    def __str__(self):
+        text = self.value() if callable(self.value) else self.value
+        text = text if isinstance(text, str) else str(text)
+        if len(text) <= self.max_chars:
+            return text
+        return f"{text[:self.max_chars]}... [{len(text) - self.max_chars} more characters]"
+
+
+def log_payload(message, value):
+    # `value` may be a callable so that e.g. decoding a response body is skipped
+    # entirely when the payload would not be logged
+    max_chars = settings["payload_max_chars"]
+    if not max_chars or not logger.isEnabledFor(logging.DEBUG):
+        return
+    if settings["payload_sample_rate"] < 1.0 and random.random() >= settings["payload_sample_rate"]:
+        return
+    logger.debug("%s:\n%s", message, Payload(value, max_chars))
+
+
+@contextmanager
+def bind_log_context(**fields):
+    token = log_context.set({**log_context.get(), **fields})
+    try:
+        yield
+    finally:
+        log_context.reset(token)
+
+
+def set_log_context(**fields):
+    # For tasks and threads whose context ends with them, where no reset is needed
+    log_context.set({**log_context.get(), **fields})
+
+
+def propagate_context(func):
+    # Thread pool workers don't inherit contextvars; run each call in a copy of the caller's context
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.copy().run(func, *args, **kwargs)
+
+
+def configure_logging(config=None):
+    """(Re)configure logging from the `log_*` config keys.
+
+    Records are put on an in-memory queue by the calling thread and written to
+    the console and the rotating log file by a background listener thread.
+    Called from the startup path (Services.config); only the handler installed
+    here is replaced, so handlers added by an embedding app are left alone.
+    """
+    with _configure_lock:
+        _configure_logging(config or {})
+
+
+def _configure_logging(config):
+    global _listener, _queue_handler
+    profile = config.get('log_profile', 'development')
+    if profile not in LOG_PROFILES:
+        raise ValueError(f"Unknown log profile: {profile}")
+    settings.clear()
+    settings.update(LOG_PROFILES[profile])
+    for key in list(settings):
+        if config.get(f'log_{key}') is not None:
+            settings[key] = config[f'log_{key}']
+
+    # The file is only opened once something is written to it
+    file_handler = RotatingFileHandler(
+        config.get('log_file', 'debug.log'),
+        maxBytes=config.get('log_max_bytes', 10000000),
+        backupCount=config.get('log_backup_count', 5),
+        delay=True,
+    )
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(settings["console_level"])
+    text_formatter = logging.Formatter(TEXT_FORMAT)
+    file_handler.setFormatter(JsonFormatter() if settings["format"] == "json" else text_formatter)
+    console_handler.setFormatter(text_formatter)
+
+    root = logging.getLogger()
+    if _queue_handler is not None:
+        root.removeHandler(_queue_handler)
+        _queue_handler.close()
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+    _listener = logging.handlers.QueueListener(
+        queue.SimpleQueue(), file_handler, console_handler, respect_handler_level=True
+    )
+    _queue_handler = QueueHandler(_listener.queue)
+    _queue_handler.addFilter(ContextFilter())
+    root.addHandler(_queue_handler)
+    root.setLevel(logging.INFO)
+    logger.setLevel(settings["level"])
+    logging.getLogger('multipart').setLevel(logging.WARNING)
+    _listener.start()
+
+
+def stop_logging():
+    # Flushes queued records; registered at exit so nothing is lost on shutdown
+    global _listener, _queue_handler
+    with _configure_lock:
+        if _queue_handler is not None:
+            logging.getLogger().removeHandler(_queue_handler)
+            _queue_handler = None
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+atexit.register(stop_logging)
 
 
-def save_debug_info(output_folder, content, topics, clips):
+def save_debug_info(output_folder, content, topics, clips, clip_results=None, timings=None):
     debug_file = os.path.join(output_folder, "debug_info.txt")
     with open(debug_file, "w") as f:
         f.write("Generated Content:\n")
@@ -25,4 +205,10 @@ def save_debug_info(output_folder, content, topics, clips):
         json.dump(topics, f, indent=2)
         f.write("\n\nGenerated Clips:\n")
         json.dump(clips, f, indent=2)
+        if clip_results is not None:
+            f.write("\n\nClip Extraction:\n")
+            json.dump(clip_results, f, indent=2)
+        if timings is not None:
+            f.write("\n\nTiming Summary (seconds):\n")
+            json.dump(timings, f, indent=2)
     logger.info(f"Debug information saved to {debug_file}")
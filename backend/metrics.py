@@ -0,0 +1,167 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Histogram buckets for the kinds of values the pipeline records
+SECONDS_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+BYTES_BUCKETS = tuple(1024 * 4 ** power for power in range(11))  # 1 KiB .. 1 GiB
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000, 128000, 200000)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+PREFIX = "summarizer_"
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in labels) + "}"
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple((name, labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items(), key=lambda item: str(item[0]))
+            lines += [line for key, value in items for line in self._render_value(key, value)]
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        if not self.labelnames:
+            # Exported as 0 from startup, so rate() sees the first increment
+            self._values[()] = 0
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _render_value(self, key, value):
+        yield f"{self.name}{format_labels(key)} {format_value(value)}"
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=SECONDS_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started, **labels)
+
+    def _render_value(self, key, state):
+        counts, total, count = state
+        for bound, bucket_count in zip(self.buckets, counts):
+            yield f"{self.name}_bucket{format_labels(key + (('le', format_value(float(bound))),))} {bucket_count}"
+        yield f"{self.name}_bucket{format_labels(key + (('le', '+Inf'),))} {count}"
+        yield f"{self.name}_sum{format_labels(key)} {format_value(total)}"
+        yield f"{self.name}_count{format_labels(key)} {count}"
+
+
+REGISTRY = []
+
+
+def counter(name, documentation, labelnames=()):
+    metric = Counter(name, documentation, labelnames)
+    REGISTRY.append(metric)
+    return metric
+
+
+def histogram(name, documentation, labelnames=(), buckets=SECONDS_BUCKETS):
+    metric = Histogram(name, documentation, labelnames, buckets)
+    REGISTRY.append(metric)
+    return metric
+
+
+def render_metrics(gauges=None):
+    # Prometheus text exposition format (version 0.0.4)
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.render()
+    for name, (documentation, value) in (gauges or {}).items():
+        lines += [f"# HELP {PREFIX}{name} {documentation}", f"# TYPE {PREFIX}{name} gauge", f"{PREFIX}{name} {format_value(value)}"]
+    return "\n".join(lines) + "\n"
+
+
+STAGE_SECONDS = histogram("pipeline_stage_seconds", "Wall time of each pipeline stage", ("stage",))
+STAGE_WAIT_SECONDS = histogram(
+    "pipeline_resource_wait_seconds", "Time stages spent waiting for a shared resource", ("resource",)
+)
+JOB_SECONDS = histogram("job_seconds", "Wall time of whole jobs", ("status",))
+COMPLETED_JOBS = counter("completed_jobs_total", "Jobs completed")
+FAILED_JOBS = counter("failed_jobs_total", "Jobs failed")
+REJECTED_JOBS = counter("rejected_jobs_total", "Jobs rejected because the queue was full")
+CANCELLED_JOBS = counter("cancelled_jobs_total", "Jobs cancelled")
+
+S3_UPLOAD_SECONDS = histogram("s3_upload_seconds", "Duration of S3 uploads")
+S3_UPLOAD_BYTES = histogram("s3_upload_bytes", "Size of S3 uploads", buckets=BYTES_BUCKETS)
+S3_PRESIGN_SECONDS = histogram("s3_presign_seconds", "Duration of presigning S3 URLs", buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1))
+
+TRANSCRIPTION_SECONDS = histogram(
+    "transcription_seconds", "Time from starting a transcription to its result", ("status",)
+)
+REPLICATE_REQUEST_SECONDS = histogram(
+    "replicate_request_seconds", "Duration of Replicate API requests", ("operation",)
+)
+TRANSCRIPTION_POLLS = histogram(
+    "transcription_polls", "Status polls made while waiting for a transcription", buckets=COUNT_BUCKETS
+)
+
+LLM_REQUEST_SECONDS = histogram("llm_request_seconds", "Duration of Anthropic API requests", ("call",))
+LLM_TOKENS = histogram("llm_tokens", "Tokens per Anthropic request", ("call", "direction"), buckets=TOKEN_BUCKETS)
+LLM_CACHE_REQUESTS = counter("llm_cache_requests_total", "LLM response cache lookups", ("call", "result"))
+
+API_RETRIES = counter("api_retries_total", "API requests retried after a rate limit or transient failure", ("provider",))
+RATE_LIMIT_WAIT_SECONDS = histogram(
+    "api_rate_limit_wait_seconds", "Time requests waited for the provider's rate limit", ("provider",)
+)
+
+FFMPEG_SECONDS = histogram("ffmpeg_seconds", "Duration of ffmpeg and ffprobe runs", ("operation",))
+FFMPEG_OUTPUT_BYTES = histogram("ffmpeg_output_bytes", "Size of files written by ffmpeg", ("operation",), buckets=BYTES_BUCKETS)
+FFMPEG_RETRIES = counter("ffmpeg_retries_total", "ffmpeg runs retried after a failure", ("operation",))
+
+PACKAGE_SECONDS = histogram("package_seconds", "Time to index job outputs for download")
+DOWNLOAD_BYTES = counter("download_bytes_total", "Bytes streamed to clients from download archives")
@@ -0,0 +1,399 @@
+import asyncio
+import os
+import time
+
+from ai_jobs import (
+    cache_transcript,
+    extract_topics,
+    generate_content,
+    get_cached_transcript,
+    select_clips,
+)
+from audio import prepare_upload_file
+from clips import ClipCutter, build_clip_specs, check_clip_results, probe_duration
+from keyframes import align_clip_specs, load_keyframe_index
+from log import logger, save_debug_info, set_log_context
+from metrics import STAGE_SECONDS, STAGE_WAIT_SECONDS
+from transcription_goal import goals_label, parse_goals
+
+
+class Stage:
+    def __init__(self, name, func, deps, weight, message, resource, checkpoint):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.weight = weight
+        self.message = message or name.replace('_', ' ').capitalize()
+        self.resource = resource
+        self.checkpoint = checkpoint
+
+
+class Pipeline:
+    """Runs stages as soon as the stages they depend on have finished.
+
+    Each stage function receives the dict of results produced so far, keyed by
+    stage name. Blocking functions are run in a worker thread; coroutine
+    functions are awaited directly. Stages tagged with a resource name only run
+    while holding that resource's semaphore from `limits`, which may be shared
+    between pipelines. Results of stages added with `checkpoint` are persisted
+    to the Checkpoint and restored instead of re-running the stage on resume;
+    `checkpoint` may also be a predicate deciding whether a result is final.
+    `event_callback(event, data)` receives stage and streamed content events,
+    possibly from worker threads.
+    """
+
+    def __init__(self, progress_callback=None, limits=None, checkpoint=None, event_callback=None):
+        self.stages = {}
+        self.limits = limits or {}
+        self.checkpoint = checkpoint
+        self.results = {}
+        self.timings = {}
+        self.waits = {}
+        self.progress_callback = progress_callback
+        self.event_callback = event_callback
+        self._completed_weight = 0
+        self._tasks = {}
+        self._started = None
+
+    def add(self, name, func, deps=(), weight=1, message=None, resource=None, checkpoint=False):
+        if name in self.stages:
+            raise ValueError(f"Duplicate pipeline stage: {name}")
+        self.stages[name] = Stage(name, func, deps, weight, message, resource, checkpoint)
+        return self
+
+    @property
+    def total_weight(self):
+        return sum(stage.weight for stage in self.stages.values()) or 1
+
+    def report(self, message, extra_weight=0):
+        percent = int(100 * (self._completed_weight + extra_weight) / self.total_weight)
+        if self.progress_callback:
+            self.progress_callback(message, min(percent, 100))
+
+    def notify(self, event, data):
+        if self.event_callback:
+            self.event_callback(event, data)
+
+    def stage_progress(self, name, fraction, message):
+        # Lets long stages report progress within their own share of the total
+        self.report(message, self.stages[name].weight * max(0.0, min(fraction, 1.0)))
+
+    def _check_graph(self):
+        for stage in self.stages.values():
+            for dep in stage.deps:
+                if dep not in self.stages:
+                    raise ValueError(f"Stage '{stage.name}' depends on unknown stage '{dep}'")
+        visiting, done = set(), set()
+
+        def visit(name):
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError(f"Pipeline has a dependency cycle through '{name}'")
+            visiting.add(name)
+            for dep in self.stages[name].deps:
+                visit(dep)
+            visiting.discard(name)
+            done.add(name)
+
+        for name in self.stages:
+            visit(name)
+
+    def restored(self, name):
+        return bool(self.stages[name].checkpoint) and self.checkpoint is not None and self.checkpoint.has(name)
+
+    async def _run_stage(self, stage):
+        # Each stage runs in its own task, so the field only applies to records from this stage
+        set_log_context(stage=stage.name)
+        if stage.deps:
+            await asyncio.gather(*(self._tasks[dep] for dep in stage.deps))
+        if self.restored(stage.name):
+            result = self.checkpoint.result(stage.name)
+            self.results[stage.name] = result
+            self._completed_weight += stage.weight
+            logger.info(f"Stage '{stage.name}' restored from checkpoint")
+            self.notify("stage", {"stage": stage.name, "state": "restored"})
+            return result
+        limit = self.limits.get(stage.resource)
+        if limit is not None:
+            wait_started = time.monotonic()
+            await limit.acquire()
+            self.waits[stage.name] = time.monotonic() - wait_started
+            STAGE_WAIT_SECONDS.observe(self.waits[stage.name], resource=stage.resource)
+        try:
+            self.report(stage.message)
+            self.notify("stage", {"stage": stage.name, "state": "started", "message": stage.message})
+            started = time.monotonic()
+            if asyncio.iscoroutinefunction(stage.func):
+                result = await stage.func(self.results)
+            else:
+                result = await asyncio.to_thread(stage.func, self.results)
+        finally:
+            if limit is not None:
+                limit.release()
+        self.timings[stage.name] = time.monotonic() - started
+        STAGE_SECONDS.observe(self.timings[stage.name], stage=stage.name)
+        self.results[stage.name] = result
+        if stage.checkpoint and self.checkpoint is not None:
+            if stage.checkpoint is True or stage.checkpoint(result):
+                await asyncio.to_thread(self.checkpoint.save_stage, stage.name, result)
+        self._completed_weight += stage.weight
+        logger.debug(f"Stage '{stage.name}' finished in {self.timings[stage.name]:.2f}s")
+        self.notify("stage", {"stage": stage.name, "state": "finished", "seconds": round(self.timings[stage.name], 3)})
+        return result
+
+    def timing_summary(self):
+        # Per-stage run and resource wait times so far, in the order stages finished
+        summary = {
+            name: {"seconds": round(seconds, 3), "wait_seconds": round(self.waits.get(name, 0.0), 3)}
+            for name, seconds in self.timings.items()
+            if name != "total"
+        }
+        summary["elapsed"] = round(time.monotonic() - self._started, 3) if self._started else 0.0
+        restored = [name for name in self.stages if self.restored(name)]
+        if restored:
+            summary["restored_from_checkpoint"] = restored
+        return summary
+
+    async def run(self):
+        self._check_graph()
+        self._started = started = time.monotonic()
+        self._tasks = {
+            name: asyncio.create_task(self._run_stage(stage), name=f"stage:{name}")
+            for name, stage in self.stages.items()
+        }
+        try:
+            await asyncio.gather(*self._tasks.values())
+        except BaseException:
+            for task in self._tasks.values():
+                task.cancel()
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+            raise
+        self.timings["total"] = time.monotonic() - started
+        logger.info(f"Pipeline stage timings: { {name: round(seconds, 2) for name, seconds in self.timings.items()} }")
+        return self.results
+
+
+def get_output_folder(media_file):
+    output_name = os.path.splitext(os.path.basename(media_file))[0]
+    return os.path.join(os.path.dirname(media_file), output_name), output_name
+
+
+def get_goal_folder(output_folder, goals, goal):
+    # With several goals each one keeps its clips and debug info in its own folder
+    return os.path.join(output_folder, goal.value) if len(goals) > 1 else output_folder
+
+
+def get_checkpoint_path(media_file, goals):
+    output_folder, _ = get_output_folder(media_file)
+    return os.path.join(output_folder, f".{goals_label(parse_goals(goals))}.checkpoint.json")
+
+
+def write_transcript_file(transcript, output_folder, output_name):
+    transcription_file = os.path.join(output_folder, f"{output_name}_transcription.txt")
+    with open(transcription_file, 'w') as f:
+        for segment in transcript:
+            f.write(f"{segment['start']} - {segment['end']}: {segment['text']}\n")
+    logger.info(f"Transcription saved to {transcription_file}")
+    return transcription_file
+
+
+def get_content_path(output_folder, output_name, goal):
+    return os.path.join(output_folder, f"{output_name}_{goal.value}.md")
+
+
+def write_content_file(content, output_folder, output_name, goal):
+    output_file = get_content_path(output_folder, output_name, goal)
+    logger.info(f"Writing content to file: {output_file}")
+    with open(output_file, 'w') as f:
+        f.write(content)
+    return output_file
+
+
+def build_media_pipeline(
+    media_file,
+    goals,
+    config,
+    media_hash,
+    replicate_client,
+    use_cache=True,
+    progress_callback=None,
+    limits=None,
+    checkpoint=None,
+    event_callback=None,
+):
+    goals = parse_goals(goals)
+    output_folder, output_name = get_output_folder(media_file)
+    os.makedirs(output_folder, exist_ok=True)
+    pipeline = Pipeline(progress_callback, limits, checkpoint, event_callback)
+    cutter = ClipCutter(media_file, config)
+
+    def stage_name(name, goal):
+        # A single-goal pipeline keeps the plain stage (and checkpoint entry) names
+        return f"{name}:{goal.value}" if len(goals) > 1 else name
+
+    def transcript_available(results):
+        return (
+            results["cached_transcript"] is not None
+            or pipeline.restored("transcript")
+            or pipeline.restored("upload")
+        )
+
+    def lookup_transcript(results):
+        if not use_cache or pipeline.restored("transcript"):
+            return None
+        return get_cached_transcript(media_hash, config)
+
+    def prepare_audio(results):
+        if transcript_available(results):
+            return None
+        return prepare_upload_file(media_file, media_hash, config)
+
+    def upload(results):
+        upload_path = results["audio"]
+        if upload_path is None:
+            return None
+        # boto3 is slow to import, so it is loaded only by pipelines that upload
+        from s3 import upload_to_s3
+
+        upload_to_s3(
+            upload_path,
+            config,
+            lambda sent, total: pipeline.stage_progress(
+                "upload", sent / max(total, 1), f"Uploading media to S3 ({sent * 100 // max(total, 1)}%)"
+            ),
+        )
+        return os.path.basename(upload_path)
+
+    async def transcribe(results):
+        if results["cached_transcript"] is not None:
+            return results["cached_transcript"]
+        from s3 import get_s3_presigned_url
+
+        # Presigning is local, so a fresh URL is cheap even when resuming an old upload
+        presigned_url = get_s3_presigned_url(results["upload"], config)
+        prediction = None
+        if checkpoint is not None and checkpoint.has("prediction"):
+            prediction = checkpoint.result("prediction")
+        transcript = await replicate_client.transcribe(
+            presigned_url,
+            prediction=prediction,
+            on_created=(lambda created: checkpoint.save_stage("prediction", created)) if checkpoint else None,
+        )
+        if use_cache:
+            await asyncio.to_thread(cache_transcript, media_hash, transcript, config)
+        return transcript
+
+    pipeline.add("media_info", lambda results: probe_duration(media_file, config), message="Probing media")
+    # Only clip cutting needs the index, so it is built while transcription and the LLM calls run
+    pipeline.add(
+        "keyframes",
+        lambda results: load_keyframe_index(media_file, media_hash, config),
+        deps=["audio"],
+        weight=2,
+        message="Indexing keyframes",
+        resource="ffmpeg",
+    )
+    pipeline.add("cached_transcript", lookup_transcript, message="Checking transcript cache")
+    pipeline.add("audio", prepare_audio, deps=["cached_transcript"], weight=5, message="Extracting audio", resource="ffmpeg")
+    pipeline.add("upload", upload, deps=["audio"], weight=10, message="Uploading media to S3", resource="upload", checkpoint=lambda name: name is not None)
+    pipeline.add("transcript", transcribe, deps=["upload"], weight=25, message="Transcribing media", resource="transcription", checkpoint=True)
+    pipeline.add(
+        "transcript_file",
+        lambda results: write_transcript_file(results["transcript"], output_folder, output_name),
+        deps=["transcript"],
+        message="Saving transcription",
+    )
+
+    def add_goal_stages(goal):
+        # Every goal shares the transcript; its LLM stages run concurrently with the other goals'
+        goal_name = goal.value.replace('_', ' ')
+        goal_folder = get_goal_folder(output_folder, goals, goal)
+        content, topics, clips, clip_files = (
+            stage_name(name, goal) for name in ("content", "topics", "clips", "clip_files")
+        )
+
+        def stream_content(results):
+            # The .md file fills in while the response streams; content_file rewrites it whole
+            with open(get_content_path(output_folder, output_name, goal), 'w') as f:
+                def on_text(text):
+                    f.write(text)
+                    f.flush()
+                    pipeline.notify("content", {"goal": goal.value, "text": text})
+
+                pipeline.notify("content_start", {"goal": goal.value})
+                return generate_content(results["transcript"], goal, config, use_cache, on_text=on_text)
+
+        def clip_specs(results):
+            selected = select_clips(results["transcript"], results[topics], goal, config, use_cache)
+            os.makedirs(goal_folder, exist_ok=True)
+            return selected, build_clip_specs(selected, media_file, goal_folder, duration=results["media_info"])
+
+        def save_debug(results):
+            selected, _ = results[clips]
+            save_debug_info(
+                goal_folder,
+                results[content],
+                results[topics],
+                selected,
+                results[clip_files],
+                pipeline.timing_summary(),
+            )
+            check_clip_results(results[clip_files])
+            return os.path.join(goal_folder, "debug_info.txt")
+
+        pipeline.add(
+            content,
+            stream_content,
+            deps=["transcript"],
+            weight=20,
+            message=f"Generating {goal_name}",
+            resource="llm",
+            checkpoint=True,
+        )
+        pipeline.add(
+            stage_name("content_file", goal),
+            lambda results: write_content_file(results[content], output_folder, output_name, goal),
+            deps=[content],
+            message=f"Saving {goal_name}",
+        )
+        pipeline.add(
+            topics,
+            lambda results: extract_topics(results[content], goal, config, use_cache),
+            deps=[content],
+            weight=5,
+            message=f"Extracting topics for {goal_name}",
+            resource="llm",
+            checkpoint=True,
+        )
+        pipeline.add(
+            clips,
+            clip_specs,
+            deps=["transcript", topics, "media_info"],
+            weight=10,
+            message=f"Finding clip boundaries for {goal_name}",
+            resource="llm",
+            checkpoint=True,
+        )
+        # Cutting starts as soon as this goal's clips are known, while other goals are still in the LLM
+        pipeline.add(
+            clip_files,
+            lambda results: cutter.extract(align_clip_specs(results[clips][1], results["keyframes"], config)),
+            deps=[clips, "keyframes"],
+            weight=15,
+            message=f"Extracting media clips for {goal_name}",
+            resource="ffmpeg",
+            # Only a run where every clip was cut is final; otherwise cut again on resume
+            checkpoint=lambda clip_results: not any(result["error"] for result in clip_results),
+        )
+        pipeline.add(
+            stage_name("debug_info", goal),
+            save_debug,
+            deps=[content, topics, clips, clip_files],
+            message="Saving debug information",
+        )
+
+    for goal in goals:
+        add_goal_stages(goal)
+    pipeline.output_folder = output_folder
+    return pipeline
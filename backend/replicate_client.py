@@ -0,0 +1,259 @@
+import asyncio
+import base64
+import binascii
+import hashlib
+import hmac
+import time
+
+import httpx
+
+from ai_jobs import transcription_request
+from api_client import (
+    PROVIDER_DEFAULTS,
+    RETRY_STATUSES,
+    DeadlineExceededError,
+    TokenBucket,
+    backoff_delay,
+    retry_after_seconds,
+)
+from log import logger
+from metrics import (
+    API_RETRIES,
+    RATE_LIMIT_WAIT_SECONDS,
+    REPLICATE_REQUEST_SECONDS,
+    TRANSCRIPTION_POLLS,
+    TRANSCRIPTION_SECONDS,
+)
+
+
+class TranscriptionError(Exception):
+    pass
+
+
+class TranscriptionTimeoutError(TranscriptionError):
+    pass
+
+
+def verify_webhook_signature(secret, headers, body, tolerance=300):
+    # Replicate signs webhooks following the Standard Webhooks scheme:
+    # base64(HMAC-SHA256(secret, "{id}.{timestamp}.{body}")) in "webhook-signature".
+    # Deliveries timestamped more than `tolerance` seconds away are refused so
+    # a captured request cannot be replayed later
+    webhook_id = headers.get("webhook-id")
+    timestamp = headers.get("webhook-timestamp")
+    signatures = headers.get("webhook-signature", "")
+    if not webhook_id or not timestamp:
+        return False
+    try:
+        if abs(time.time() - int(timestamp)) > tolerance:
+            return False
+        key = base64.b64decode(secret.split("_", 1)[1] if secret.startswith("whsec_") else secret, validate=True)
+    except (ValueError, binascii.Error):
+        return False
+    signed_content = f"{webhook_id}.{timestamp}.".encode() + body
+    expected = base64.b64encode(hmac.new(key, signed_content, hashlib.sha256).digest()).decode()
+    return any(
+        hmac.compare_digest(expected, signature.split(",", 1)[-1])
+        for signature in signatures.split()
+    )
+
+
+class ReplicateClient:
+    """Asyncio transcription client sharing one HTTP connection pool across all jobs.
+
+    Like the shared API client, requests pass through a request bucket and
+    transient failures are retried with jittered backoff within a deadline.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.max_attempts = config.get("replicate_max_attempts", 5)
+        self.backoff_base = config.get("api_backoff_base", 0.5)
+        self.backoff_max = config.get("api_backoff_max", 30.0)
+        self.deadline = config.get("replicate_request_deadline", PROVIDER_DEFAULTS["replicate"]["deadline"])
+        self.requests_bucket = TokenBucket(
+            config.get("replicate_requests_per_minute", PROVIDER_DEFAULTS["replicate"]["requests_per_minute"])
+        )
+        self._client = httpx.AsyncClient(
+            headers={"Authorization": f"Bearer {config['replicate_api_key']}"},
+            timeout=httpx.Timeout(config.get("replicate_request_timeout", 30.0)),
+            limits=httpx.Limits(
+                max_connections=config.get("replicate_max_connections", 20),
+                max_keepalive_connections=config.get("replicate_max_connections", 20),
+            ),
+        )
+        self._waiters = {}
+        self._early_results = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        await self._client.aclose()
+
+    @property
+    def webhook_url(self):
+        # The webhook route refuses unsigned deliveries, so without a secret the
+        # webhook would never be accepted and polling is used instead
+        if not self.config.get("replicate_webhook_secret"):
+            return None
+        return self.config.get("replicate_webhook_url")
+
+    async def _request(self, method, url, operation, idempotent=True, **kwargs):
+        # Creating a prediction is only retried when Replicate certainly did not
+        # act on it: rate limiting and connections that were never established
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            attempt += 1
+            waited = await self.requests_bucket.acquire_async(1, deadline)
+            if waited:
+                RATE_LIMIT_WAIT_SECONDS.observe(waited, provider="replicate")
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise DeadlineExceededError("replicate request deadline exceeded")
+
+            retry_after = None
+            error = None
+            try:
+                with REPLICATE_REQUEST_SECONDS.time(operation=operation):
+                    response = await self._client.request(
+                        method, url, timeout=min(self.config.get("replicate_request_timeout", 30.0), remaining), **kwargs
+                    )
+            except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                error = e
+                retryable = True
+            except httpx.TransportError as e:
+                error = e
+                retryable = idempotent
+            else:
+                retry_after = retry_after_seconds(response.headers)
+                if response.status_code == 429 and retry_after:
+                    self.requests_bucket.pause(retry_after)
+                if response.status_code not in RETRY_STATUSES:
+                    response.raise_for_status()
+                    return response
+                retryable = idempotent or response.status_code == 429
+
+            delay = backoff_delay(attempt, self.backoff_base, self.backoff_max, retry_after)
+            if not retryable or attempt >= self.max_attempts or time.monotonic() + delay >= deadline:
+                if error is not None:
+                    raise error
+                response.raise_for_status()
+            API_RETRIES.inc(provider="replicate")
+            logger.warning(
+                f"replicate {operation} request failed ({repr(error) if error else response.status_code}), "
+                f"retrying in {delay:.1f}s (attempt {attempt}/{self.max_attempts})"
+            )
+            await asyncio.sleep(delay)
+
+    async def start_transcription(self, url):
+        logger.debug(f"Starting transcription for URL: {url}")
+        data = transcription_request(url, self.config)
+        if self.webhook_url:
+            data["webhook"] = self.webhook_url
+            data["webhook_events_filter"] = ["completed"]
+        response = await self._request("POST", self.config["replicate_api_url"], "create", idempotent=False, json=data)
+        prediction = response.json()
+        logger.info(f"Replicate prediction {prediction['id']} created")
+        return prediction
+
+    async def get_prediction(self, prediction_url):
+        response = await self._request("GET", prediction_url, "get")
+        return response.json()
+
+    async def cancel_prediction(self, prediction):
+        cancel_url = prediction.get("urls", {}).get("cancel")
+        if not cancel_url:
+            return
+        try:
+            await self._request("POST", cancel_url, "cancel")
+            logger.info(f"Replicate prediction {prediction['id']} cancelled")
+        except (httpx.HTTPError, DeadlineExceededError) as e:
+            logger.warning(f"Failed to cancel Replicate prediction {prediction['id']}: {str(e)}")
+
+    def resolve_webhook(self, prediction):
+        # Called by the webhook route; wakes the job waiting on this prediction
+        waiter = self._waiters.get(prediction.get("id"))
+        if waiter is not None and not waiter.done():
+            waiter.set_result(prediction)
+            return True
+        # The webhook can beat the create call's response back to us. Results
+        # no job claims within the TTL are dropped
+        now = time.monotonic()
+        ttl = self.config.get("replicate_webhook_early_ttl", 120)
+        for prediction_id, (_, received_at) in list(self._early_results.items()):
+            if now - received_at > ttl:
+                del self._early_results[prediction_id]
+        if len(self._early_results) < 1000:
+            self._early_results[prediction.get("id")] = (prediction, now)
+        return False
+
+    async def _wait(self, prediction):
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        early_result = self._early_results.pop(prediction["id"], None)
+        if early_result is not None:
+            waiter.set_result(early_result[0])
+        self._waiters[prediction["id"]] = waiter
+        interval = self.config.get("replicate_poll_initial_interval", 1.0)
+        max_interval = self.config.get("replicate_poll_max_interval", 15.0)
+        if self.webhook_url:
+            # Polling only guards against a lost webhook delivery
+            interval = max_interval = self.config.get("replicate_webhook_poll_interval", 30.0)
+        polls = 0
+        try:
+            while True:
+                try:
+                    return await asyncio.wait_for(asyncio.shield(waiter), timeout=interval)
+                except asyncio.TimeoutError:
+                    pass
+                polls += 1
+                result = await self.get_prediction(prediction["urls"]["get"])
+                logger.debug(f"Transcription status: {result['status']}")
+                if result["status"] in ("succeeded", "failed", "canceled"):
+                    return result
+                interval = min(interval * 1.5, max_interval)
+        finally:
+            self._waiters.pop(prediction["id"], None)
+            TRANSCRIPTION_POLLS.observe(polls)
+
+    async def transcribe(self, url, prediction=None, on_created=None):
+        deadline = self.config.get("transcription_timeout", 3 * 3600)
+        started = time.monotonic()
+        result = None
+        if prediction is not None:
+            # Resuming a job: reattach to its prediction unless it can no longer succeed
+            current = await self.get_prediction(prediction["urls"]["get"])
+            if current["status"] in ("failed", "canceled"):
+                logger.info(f"Replicate prediction {prediction['id']} {current['status']}, starting a new one")
+                prediction = None
+            elif current["status"] == "succeeded":
+                result = current
+            else:
+                logger.info(f"Resuming Replicate prediction {prediction['id']} ({current['status']})")
+        if prediction is None:
+            prediction = await self.start_transcription(url)
+            if on_created:
+                on_created(prediction)
+        try:
+            if result is None:
+                result = await asyncio.wait_for(self._wait(prediction), timeout=deadline)
+        except asyncio.TimeoutError:
+            TRANSCRIPTION_SECONDS.observe(time.monotonic() - started, status="timeout")
+            await self.cancel_prediction(prediction)
+            raise TranscriptionTimeoutError(f"Transcription did not finish within {deadline} seconds")
+        except asyncio.CancelledError:
+            TRANSCRIPTION_SECONDS.observe(time.monotonic() - started, status="cancelled")
+            await asyncio.shield(self.cancel_prediction(prediction))
+            raise
+
+        TRANSCRIPTION_SECONDS.observe(time.monotonic() - started, status=result["status"])
+        if result["status"] != "succeeded":
+            logger.error(f"Transcription process {result['status']}: {result.get('error')}")
+            raise TranscriptionError(f"Transcription process {result['status']}.")
+        logger.info(f"Transcription completed successfully in {time.monotonic() - started:.1f}s")
+        return result["output"]["segments"]
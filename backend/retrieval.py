@@ -0,0 +1,113 @@
+import re
+
+import numpy as np
+
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9']+")
+
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from had has have he her his i if in into is it its "
+    "just like me my no not of on or our she so that the their them then there these they "
+    "this to um uh was we were what when which who will with yeah you your".split()
+)
+
+
+def tokenize(text):
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def build_windows(transcript, window_seconds=180.0, stride_seconds=60.0):
+    # Overlapping windows aligned to segment boundaries, so a clip built from a
+    # window never starts or ends mid-segment
+    windows = []
+    starts = [segment['start'] for segment in transcript]
+    first = 0
+    while first < len(transcript):
+        window_start = transcript[first]['start']
+        last = first
+        while last + 1 < len(transcript) and transcript[last + 1]['end'] - window_start <= window_seconds:
+            last += 1
+        windows.append({
+            "start": window_start,
+            "end": transcript[last]['end'],
+            "text": " ".join(segment['text'].strip() for segment in transcript[first:last + 1]),
+            "segments": transcript[first:last + 1],
+        })
+        if last + 1 >= len(transcript):
+            break
+        next_first = first + 1
+        while next_first < len(transcript) and starts[next_first] < window_start + stride_seconds:
+            next_first += 1
+        first = min(next_first, last + 1)
+    return windows
+
+
+class BM25Index:
+    def __init__(self, documents, k1=1.5, b=0.75):
+        tokenized = [tokenize(document) for document in documents]
+        self.vocabulary = {}
+        for tokens in tokenized:
+            for token in tokens:
+                self.vocabulary.setdefault(token, len(self.vocabulary))
+
+        # Dense term-frequency matrix: windows x vocabulary
+        self.term_frequencies = np.zeros((len(documents), max(len(self.vocabulary), 1)), dtype=np.float32)
+        for row, tokens in enumerate(tokenized):
+            if tokens:
+                columns = np.fromiter((self.vocabulary[token] for token in tokens), dtype=np.int64, count=len(tokens))
+                np.add.at(self.term_frequencies[row], columns, 1.0)
+
+        lengths = self.term_frequencies.sum(axis=1)
+        average_length = lengths.mean() if len(documents) else 0.0
+        document_frequencies = (self.term_frequencies > 0).sum(axis=0)
+        self.idf = np.log1p((len(documents) - document_frequencies + 0.5) / (document_frequencies + 0.5))
+        # Precompute the BM25 term weight for every (window, term) pair
+        norm = k1 * (1 - b + b * lengths / max(average_length, 1e-9))
+        self.weights = self.term_frequencies * (k1 + 1) / (self.term_frequencies + norm[:, None])
+
+    def scores(self, query):
+        columns = [self.vocabulary[token] for token in set(tokenize(query)) if token in self.vocabulary]
+        if not columns:
+            return np.zeros(self.weights.shape[0], dtype=np.float32)
+        return self.weights[:, columns] @ self.idf[columns]
+
+    def top_k(self, query, k):
+        scores = self.scores(query)
+        k = min(k, len(scores))
+        if k == 0:
+            return []
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return [(int(index), float(scores[index])) for index in best if scores[index] > 0]
+
+
+def topic_query(topic):
+    keywords = topic.get('keywords') or []
+    if isinstance(keywords, str):
+        keywords = [keywords]
+    return " ".join([topic.get('title', '')] + list(keywords))
+
+
+def find_candidate_windows(transcript, topics, config):
+    windows = build_windows(
+        transcript,
+        config.get('clip_window_seconds', 180.0),
+        config.get('clip_window_stride_seconds', 60.0),
+    )
+    index = BM25Index([window['text'] for window in windows])
+    top_k = config.get('clip_candidate_windows', 3)
+    candidates = []
+    for topic in topics:
+        ranked = index.top_k(topic_query(topic), top_k)
+        candidates.append([dict(windows[i], score=score) for i, score in ranked])
+    return candidates
+
+
+def select_clips_locally(transcript, topics, config):
+    clips = []
+    for topic, windows in zip(topics, find_candidate_windows(transcript, topics, config)):
+        if not windows:
+            continue
+        best = windows[0]
+        clips.append({"title": topic['title'], "start": best['start'], "end": best['end']})
+    return clips
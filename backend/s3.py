@@ -1,24 +1,96 @@
 import os
-import subprocess
+import threading
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 
 from log import logger
+from metrics import S3_PRESIGN_SECONDS, S3_UPLOAD_BYTES, S3_UPLOAD_SECONDS
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_s3_client(config):
+    # One client per endpoint, shared across jobs so its connection pool is reused
+    endpoint_url = config.get('s3_endpoint_url')
+    with _clients_lock:
+        client = _clients.get(endpoint_url)
+        if client is None:
+            client = boto3.session.Session().client(
+                's3',
+                endpoint_url=endpoint_url,
+                region_name=config.get('aws_region'),
+                aws_access_key_id=config.get('aws_access_key_id'),
+                aws_secret_access_key=config.get('aws_secret_access_key'),
+                config=Config(
+                    signature_version='s3v4',
+                    max_pool_connections=config.get('s3_max_pool_connections', 32),
+                    retries={'max_attempts': config.get('s3_max_attempts', 5), 'mode': 'adaptive'},
+                    s3={'addressing_style': config.get('s3_addressing_style', 'auto')},
+                ),
+            )
+            _clients[endpoint_url] = client
+        return client
+
 
+def get_s3_key(file_name):
+    return f"public/{file_name}"
 
-def upload_to_s3(file_path, config):
+
+class UploadProgress:
+    def __init__(self, total_bytes, callback):
+        self.total_bytes = total_bytes
+        self.bytes_sent = 0
+        self.callback = callback
+        self._last_percent = -1
+        self._lock = threading.Lock()
+
+    def __call__(self, bytes_amount):
+        # boto3 reports progress from its worker threads, one call per chunk
+        with self._lock:
+            self.bytes_sent += bytes_amount
+            percent = self.bytes_sent * 100 // max(self.total_bytes, 1)
+            if percent == self._last_percent:
+                return
+            self._last_percent = percent
+            bytes_sent = self.bytes_sent
+        if self.callback:
+            self.callback(bytes_sent, self.total_bytes)
+
+
+def upload_to_s3(file_path, config, progress_callback=None):
     logger.debug(f"Uploading file to S3: {file_path}")
-    command = f"{config['aws_cli_path']} s3 cp {file_path} s3://{config['s3_bucket']}/public/{os.path.basename(file_path)}"
-    logger.debug(f"S3 upload command: {command}")
-    subprocess.run(command, shell=True, check=True)
-    logger.info(f"File uploaded successfully to S3: {file_path}")
+    transfer_config = TransferConfig(
+        multipart_threshold=config.get('s3_multipart_threshold', 16 * 1024 * 1024),
+        multipart_chunksize=config.get('s3_part_size', 16 * 1024 * 1024),
+        max_concurrency=config.get('s3_upload_concurrency', 8),
+        use_threads=True,
+    )
+    progress = UploadProgress(os.path.getsize(file_path), progress_callback)
+    with S3_UPLOAD_SECONDS.time():
+        get_s3_client(config).upload_file(
+            file_path,
+            config['s3_bucket'],
+            get_s3_key(os.path.basename(file_path)),
+            Config=transfer_config,
+            Callback=progress,
+        )
+    S3_UPLOAD_BYTES.observe(progress.bytes_sent)
+    logger.info(f"File uploaded successfully to S3: {file_path} ({progress.bytes_sent} bytes)")
 
 
 def get_s3_presigned_url(file_name, config):
     logger.debug(f"Getting presigned URL for file: {file_name}")
-    command = f"{config['aws_cli_path']} s3 presign s3://{config['s3_bucket']}/public/{file_name}"
-    logger.debug(f"S3 presign command: {command}")
-    result = subprocess.run(
-        command, shell=True, capture_output=True, text=True, check=True
-    )
-    presigned_url = result.stdout.strip()
-    logger.info(f"Presigned URL generated: {presigned_url}")
+    # Presigning is a local signing operation, no request is made to S3
+    with S3_PRESIGN_SECONDS.time():
+        presigned_url = get_s3_client(config).generate_presigned_url(
+            'get_object',
+            Params={'Bucket': config['s3_bucket'], 'Key': get_s3_key(file_name)},
+            ExpiresIn=config.get('s3_presign_expiry', 3600),
+        )
+    # The URL itself is a bearer credential for the object, so it is not logged
+    logger.info(f"Presigned URL generated for {file_name}")
     return presigned_url
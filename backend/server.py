@@ -1,40 +1,31 @@
 import os
-import subprocess
+import json
+import shutil
 import asyncio
-import zipfile
+import time
 import tempfile
+from typing import List, Optional
 
 
 from fastapi import (
     FastAPI,
-    File,
-    UploadFile,
-    Form,
-    Depends,
-    BackgroundTasks
+    Request
 )
 from fastapi.exceptions import HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel
 
-from ai_jobs import (
-    create_media_clips,
-    generate_content,
-    get_transcription_result,
-    start_transcription,
-)
-from s3 import get_s3_presigned_url, upload_to_s3
-from log import logger, save_debug_info
-from transcription_goal import TranscriptionGoal
-from utils import load_config
-
-
+from cache import llm_cache, transcript_cache
+from checkpoints import Checkpoint
+from jobs import Job, JobManager, QueueFullError
+from log import logger, set_log_context
+from metrics import DOWNLOAD_BYTES, render_metrics
+from pipeline import build_media_pipeline, get_output_folder
+from transcription_goal import goals_label, parse_goals
+from services import services
+from zipstream import ZipPackage
 
-# Global variables
-processing_status = None
-zip_file_path = None
-config = load_config()
 
 # FastAPI app setup
 app = FastAPI()
@@ -47,167 +38,414 @@ app.add_middleware(
 )
 
 class ProcessingStatus(BaseModel):
+    job_id: Optional[str] = None
     status: str
     progress: int
     message: str
 
-def update_processing_status(status: str, progress: int, message: str):
-    global processing_status
-    processing_status = ProcessingStatus(status=status, progress=progress, message=message)
-    logger.info(f"Status Update: {status} - Progress: {progress}% - Message: {message}")
-    return processing_status
-
-def create_zip_of_processed_files(output_folder):
-    logger.info(f"Creating zip file for folder: {output_folder}")
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.zip') as temp_zip:
-        temp_zip_path = temp_zip.name
-
-    with zipfile.ZipFile(temp_zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        for root, _, files in os.walk(output_folder):
-            for file in files:
-                file_path = os.path.join(root, file)
-                arcname = os.path.relpath(file_path, output_folder)
-                zipf.write(file_path, arcname)
-                logger.debug(f"Added file to zip: {arcname}")
-
-    logger.info(f"Zip file created: {temp_zip_path}")
-    return temp_zip_path
-
-def get_transcription_goal(goal: str = Form(...)) -> TranscriptionGoal:
+def get_spool_dir():
+    return services.config.get('spool_dir') or os.path.join(tempfile.gettempdir(), "ai-video-summarizer")
+
+def job_checkpoint(job: Job) -> Checkpoint:
+    # Everything needed to rebuild the job after a server restart lives in its checkpoint
+    return Checkpoint(
+        os.path.join(job.work_dir, "checkpoint.json"),
+        {
+            "job_id": job.id,
+            "goal": goals_label(job.goals),
+            "media_file": job.media_file,
+            "media_hash": job.media_hash,
+            "media_size": job.media_size,
+            "use_cache": job.use_cache,
+        },
+    )
+
+async def process_media(job: Job):
+    media_file = job.media_file
+    goals = job.goals
+    if job.checkpoint is None:
+        job.checkpoint = await asyncio.to_thread(job_checkpoint, job)
+    checkpoint = job.checkpoint
+    # Jobs run in their own task, so every record logged while processing carries the job fields
+    set_log_context(job_id=job.id, goal=goals_label(goals))
     try:
-        return TranscriptionGoal(goal)
-    except ValueError:
-        raise HTTPException(status_code=422, detail="Invalid transcription goal")
-
-def execute_ffmpeg_commands(commands):
-    logger.debug(f"Executing FFmpeg commands: {commands}")
-    for command in commands.split('&&'):
-        logger.debug(f"Executing command: {command.strip()}")
-        subprocess.run(command.strip(), shell=True, check=True)
-    logger.info("All FFmpeg commands executed successfully")
-
-async def process_media(media_file: str, goal: TranscriptionGoal):
-    global processing_status
-    try:
-        update_processing_status("processing", 0, "Starting transcription process")
-        logger.info(f"Processing started for {media_file} with goal {goal}")
-
-        # Use asyncio.to_thread for potentially blocking operations
-        update_processing_status("processing", 10, "Uploading file to S3")
-        await asyncio.to_thread(upload_to_s3, media_file, config)
-
-        presigned_url = await asyncio.to_thread(get_s3_presigned_url, os.path.basename(media_file), config)
-        update_processing_status("processing", 20, "Generating presigned URL")
-
-        prediction = await asyncio.to_thread(start_transcription, presigned_url, config)
-        update_processing_status("processing", 30, "Starting transcription")
-
-        transcript = await asyncio.to_thread(get_transcription_result, prediction['urls']['get'], config)
-        update_processing_status("processing", 40, "Processing transcription")
-
-        # Save transcription to file
-        output_name = os.path.splitext(os.path.basename(media_file))[0]
-        output_folder = os.path.join(os.path.dirname(media_file), output_name)
-        os.makedirs(output_folder, exist_ok=True)
-        transcription_file = os.path.join(output_folder, f"{output_name}_transcription.txt")
-        with open(transcription_file, 'w') as f:
-            for segment in transcript:
-                f.write(f"{segment['start']} - {segment['end']}: {segment['text']}\n")
-        logger.info(f"Transcription saved to {transcription_file}")
-
-        content = await asyncio.to_thread(generate_content, transcript, goal, config)
-        update_processing_status("processing", 60, f"Generating {goal.value.replace('_', ' ')}")
-
-        output_file = os.path.join(output_folder, f"{output_name}_{goal.value}.md")
-        with open(output_file, 'w') as f:
-            f.write(content)
-        update_processing_status("processing", 70, "Saving generated content")
-
-        ffmpeg_commands, topics, clips = await asyncio.to_thread(create_media_clips, transcript, content, media_file, output_folder, goal, config)
-        update_processing_status("processing", 80, "Creating media clips")
-
-        await asyncio.to_thread(save_debug_info, output_folder, content, topics, clips)
-        update_processing_status("processing", 90, "Saving debug information")
-
-        await asyncio.to_thread(execute_ffmpeg_commands, ffmpeg_commands)
-        update_processing_status("processing", 95, "Executing FFmpeg commands")
+        job.update("processing", 0, "Starting transcription process")
+        logger.info(f"Processing started for {media_file} with goals {goals_label(goals)}")
+        await asyncio.to_thread(checkpoint.mark, "running")
+
+        pipeline = build_media_pipeline(
+            media_file,
+            goals,
+            services.config,
+            job.media_hash,
+            services.replicate_client,
+            use_cache=job.use_cache,
+            progress_callback=lambda message, progress: job.update("processing", progress, message),
+            checkpoint=checkpoint,
+            event_callback=job.publish,
+        )
+        job.timings = pipeline.timings
+        pipeline.add(
+            "package",
+            lambda results: ZipPackage.from_folder(pipeline.output_folder),
+            # Packaged once every output of every goal has been written
+            deps=list(pipeline.stages),
+            weight=5,
+            message="Creating download package",
+        )
+        results = await pipeline.run()
+        job.output_folder = pipeline.output_folder
+        job.package = results["package"]
+
+        await asyncio.to_thread(checkpoint.mark, "completed")
+        job.update("completed", 100, "Process complete")
+        logger.info(f"Processing completed for {media_file}")
 
-        zip_file_path = await asyncio.to_thread(create_zip_of_processed_files, output_folder)
-        update_processing_status("processing", 98, "Creating download package")
+        # The upload is only kept around while the job may still need to resume
+        if os.path.exists(media_file):
+            os.remove(media_file)
+            logger.info(f"Temporary file {media_file} removed")
 
-        update_processing_status("completed", 100, "Process complete")
-        logger.info(f"Processing completed for {media_file}")
+        return job.package
 
-        return zip_file_path
+    except asyncio.CancelledError:
+        await asyncio.to_thread(checkpoint.mark, "cancelled")
+        raise
 
     except Exception as e:
         logger.error(f"An error occurred while processing {media_file}: {str(e)}", exc_info=True)
-        update_processing_status("error", 0, f"Error: {str(e)}")
+        await asyncio.to_thread(checkpoint.mark, "error")
+        job.update("error", 0, f"Error: {str(e)} (retry to resume from the last completed stage)")
         return None
 
-    finally:
-        if os.path.exists(media_file):
-            os.remove(media_file)
-            logger.info(f"Temporary file {media_file} removed")
 
+_job_manager = None
+
+
+def get_job_manager() -> JobManager:
+    # Created on first use, which also loads the config, so importing this module stays cheap
+    global _job_manager
+    if _job_manager is None:
+        config = services.config
+        _job_manager = JobManager(
+            process_media,
+            max_workers=config.get('max_concurrent_jobs', 2),
+            max_queued=config.get('max_queued_jobs', 8),
+            retention_seconds=config.get('job_retention_seconds', 3600),
+        )
+    return _job_manager
+
+
+def recover_jobs():
+    # Re-register jobs found in the spool directory after a restart. Jobs that
+    # were queued or running are resumed; failed ones can be retried.
+    spool_dir = get_spool_dir()
+    if not os.path.isdir(spool_dir):
+        return
+    for job_id in os.listdir(spool_dir):
+        job_dir = os.path.join(spool_dir, job_id)
+        checkpoint = Checkpoint.load(os.path.join(job_dir, "checkpoint.json"))
+        if checkpoint is None:
+            continue
+        metadata = checkpoint.metadata
+        output_folder, _ = get_output_folder(metadata.get("media_file", ""))
+        completed = checkpoint.status == "completed" and os.path.isdir(output_folder)
+        if not completed and not os.path.exists(metadata.get("media_file", "")):
+            shutil.rmtree(job_dir, ignore_errors=True)
+            continue
+        job = Job(parse_goals(metadata["goal"]), job_id=job_id)
+        job.work_dir = job_dir
+        job.media_file = metadata["media_file"]
+        job.media_hash = metadata["media_hash"]
+        job.media_size = metadata.get("media_size", 0)
+        job.use_cache = metadata.get("use_cache", True)
+        job.checkpoint = checkpoint
+        if completed:
+            # Outputs stay on disk until retention expires, so the download survives a restart
+            job.output_folder = output_folder
+            get_job_manager().register(job)
+            job.update("completed", 100, "Process complete")
+            job.finished_at = time.monotonic()
+            continue
+        if checkpoint.status in ("queued", "running"):
+            try:
+                get_job_manager().submit(job)
+                logger.info(f"Resuming job {job_id} after restart")
+                continue
+            except QueueFullError:
+                pass
+        get_job_manager().register(job)
+        job.update("error", 0, "Interrupted. Retry to resume from the last completed stage")
+        job.finished_at = time.monotonic()
+
+@app.on_event("startup")
+async def start_job_manager():
+    get_job_manager().start()
+    recover_jobs()
+
+@app.on_event("shutdown")
+async def stop_job_manager():
+    await get_job_manager().stop()
+    await services.aclose()
+
+def queue_full_exception():
+    return HTTPException(
+        status_code=429,
+        detail="Too many jobs in progress. Please retry later.",
+        headers={"Retry-After": "30"},
+    )
+
+def parse_form_bool(values: List[str], default: bool) -> bool:
+    if not values:
+        return default
+    value = values[-1].strip().lower()
+    if value in ("1", "true", "on", "yes"):
+        return True
+    if value in ("0", "false", "off", "no"):
+        return False
+    raise HTTPException(status_code=422, detail="Invalid boolean form value")
 
 @app.post("/upload")
-async def upload_file(
-    file: UploadFile = File(...),
-    goal: TranscriptionGoal = Depends(get_transcription_goal),
-    background_tasks: BackgroundTasks = BackgroundTasks()
-):
-    global zip_file_path
-    file_location = f"/tmp/{file.filename}"
-    with open(file_location, "wb+") as file_object:
-        file_object.write(await file.read())
-    
-    update_processing_status("processing", 0, "Starting processing")
-    background_tasks.add_task(process_and_set_zip_path, file_location, goal)
-    return {"message": "File uploaded successfully. Processing started."}
-
-async def process_and_set_zip_path(file_location: str, goal: TranscriptionGoal):
-    global zip_file_path
-    zip_file_path = await process_media(file_location, goal)
-
-@app.get("/status")
-async def get_status():
-    global processing_status
-    if processing_status is None:
-        return ProcessingStatus(status="idle", progress=0, message="")
-    return processing_status
-
-@app.get("/download")
-async def download_processed_files():
-    global zip_file_path
-    logger.info(f"Download requested. Zip file path: {zip_file_path}")
-    if zip_file_path and os.path.exists(zip_file_path):
+async def upload_file(request: Request):
+    # The form is parsed from the request stream rather than by FastAPI, which
+    # would spool the whole body to a temporary file before this handler runs
+    max_upload_bytes = services.config.get('max_upload_bytes')
+    if max_upload_bytes and "content-length" in request.headers:
+        try:
+            content_length = int(request.headers["content-length"])
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid Content-Length header")
+        # The multipart body carries some form overhead on top of the file itself
+        if content_length > max_upload_bytes + 1024 * 1024:
+            raise HTTPException(status_code=413, detail="Uploaded file is too large")
+    if not get_job_manager().running:
+        raise HTTPException(status_code=503, detail="Server is not accepting jobs")
+    # Reject before touching the disk when there is no room in the queue
+    if get_job_manager().is_full():
+        get_job_manager().record_rejection()
+        raise queue_full_exception()
+
+    from uploads import MultipartUpload, UploadFormError, UploadTooLargeError
+
+    job = Job([])
+    job.work_dir = os.path.join(get_spool_dir(), job.id)
+    os.makedirs(job.work_dir, exist_ok=True)
+    try:
+        upload = MultipartUpload(
+            request.headers.get("content-type"),
+            job.work_dir,
+            services.config.get('upload_chunk_size', 1024 * 1024),
+            max_upload_bytes,
+        )
+        await upload.read(request.stream())
         try:
-            logger.info(f"Sending file: {zip_file_path}")
-            return FileResponse(
-                zip_file_path,
-                media_type='application/zip',
-                filename="processed_files.zip",
-                headers={"Content-Disposition": "attachment; filename=processed_files.zip"}
-            )
+            # The goal field may be repeated, or hold several goals joined with "+" or ","
+            job.goals = parse_goals(upload.fields.get("goal", []))
+        except ValueError:
+            raise HTTPException(status_code=422, detail="Invalid transcription goal")
+        job.use_cache = parse_form_bool(upload.fields.get("use_cache", []), True)
+    except UploadTooLargeError as e:
+        shutil.rmtree(job.work_dir, ignore_errors=True)
+        raise HTTPException(status_code=413, detail=str(e))
+    except UploadFormError as e:
+        shutil.rmtree(job.work_dir, ignore_errors=True)
+        raise HTTPException(status_code=400, detail=str(e))
+    except BaseException:
+        shutil.rmtree(job.work_dir, ignore_errors=True)
+        raise
+    job.media_file = upload.path
+    job.media_hash = upload.sha256
+    job.media_size = upload.size
+
+    # Written before the worker can pick the job up; the worker then reuses this instance
+    job.checkpoint = await asyncio.to_thread(job_checkpoint, job)
+    await asyncio.to_thread(job.checkpoint.mark, "queued")
+    try:
+        get_job_manager().submit(job)
+    except QueueFullError:
+        shutil.rmtree(job.work_dir, ignore_errors=True)
+        raise queue_full_exception()
+
+    return {"message": "File uploaded successfully. Processing started.", "job_id": job.id}
+
+def get_job_or_404(job_id: str) -> Job:
+    job = get_job_manager().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/status/{job_id}")
+async def get_status(job_id: str):
+    job = get_job_or_404(job_id)
+    return ProcessingStatus(job_id=job.id, status=job.status, progress=job.progress, message=job.message)
+
+def format_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.get("/events/{job_id}")
+async def stream_job_events(job_id: str, request: Request):
+    # Server-sent events: "status" on every progress update, "stage" as pipeline
+    # stages start and finish, and "content_start"/"content" with the generated
+    # text as it streams in. Content so far is replayed on connect; the stream
+    # ends after the status event of a finished job.
+    job = get_job_or_404(job_id)
+    queue = job.subscribe()
+    heartbeat = services.config.get('events_heartbeat_seconds', 15)
+
+    async def events():
+        try:
+            while True:
+                try:
+                    event, data = await asyncio.wait_for(queue.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    # Comment line that keeps proxies from closing an idle connection
+                    yield ": keep-alive\n\n"
+                    continue
+                yield format_event(event, data)
+                if event == "status" and data["status"] in ("completed", "error", "cancelled"):
+                    return
         finally:
-            # Schedule the removal of the temporary file
-            asyncio.create_task(remove_temp_file(zip_file_path))
-    logger.error("Processed files not available")
-    return {"error": "Processed files not available"}
-
-async def remove_temp_file(file_path):
-    await asyncio.sleep(60)  # Wait for 60 seconds to ensure the file has been sent
-    if os.path.exists(file_path):
-        os.remove(file_path)
-        logger.info(f"Temporary zip file removed: {file_path}")
-
-@app.get("/download/{filename}")
-async def download_file(filename: str):
-    file_path = f"/tmp/{filename}"
-    if os.path.exists(file_path):
-        return FileResponse(file_path, filename=filename)
-    return {"error": "File not found"}
+            job.unsubscribe(queue)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    get_job_or_404(job_id)
+    if not get_job_manager().cancel(job_id):
+        raise HTTPException(status_code=409, detail="Job has already finished")
+    return {"message": "Job cancellation requested", "job_id": job_id}
+
+@app.post("/jobs/{job_id}/retry")
+async def retry_job(job_id: str):
+    job = get_job_or_404(job_id)
+    if job.status not in ("error", "cancelled"):
+        raise HTTPException(status_code=409, detail="Only failed or cancelled jobs can be retried")
+    if not os.path.exists(job.media_file):
+        raise HTTPException(status_code=410, detail="The uploaded file for this job is no longer available")
+    try:
+        get_job_manager().retry(job)
+    except QueueFullError:
+        raise queue_full_exception()
+    return {"message": "Job resubmitted", "job_id": job.id}
+
+@app.get("/queue")
+async def get_queue_metrics():
+    return get_job_manager().metrics()
+
+@app.post("/webhooks/replicate")
+async def replicate_webhook(request: Request):
+    body = await request.body()
+    from replicate_client import verify_webhook_signature
+
+    secret = services.config.get('replicate_webhook_secret')
+    if not secret:
+        raise HTTPException(status_code=401, detail="Webhooks are not accepted without replicate_webhook_secret")
+    tolerance = services.config.get('replicate_webhook_tolerance', 300)
+    if not verify_webhook_signature(secret, request.headers, body, tolerance):
+        raise HTTPException(status_code=401, detail="Invalid webhook signature")
+    try:
+        prediction = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Webhook body is not valid JSON")
+    if not isinstance(prediction, dict) or not prediction.get("id"):
+        raise HTTPException(status_code=400, detail="Webhook body is not a prediction")
+    logger.debug(f"Replicate webhook for prediction {prediction.get('id')}: {prediction.get('status')}")
+    services.replicate_client.resolve_webhook(prediction)
+    return {"received": True}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    queue = get_job_manager().metrics()
+    gauges = {
+        "active_jobs": ("Jobs currently being processed", queue["active_jobs"]),
+        "queued_jobs": ("Jobs waiting for a worker", queue["queue_depth"]),
+    }
+    return PlainTextResponse(render_metrics(gauges), media_type="text/plain; version=0.0.4")
+
+@app.get("/cache")
+async def get_cache_stats():
+    return {
+        "transcript": transcript_cache(services.config).stats(),
+        "llm": llm_cache(services.config).stats(),
+    }
+
+def parse_range(range_header: Optional[str], size: int):
+    # Single "bytes=" ranges only; anything else is served as the full archive
+    if not range_header or not range_header.startswith("bytes=") or "," in range_header:
+        return None
+    first, _, last = range_header[len("bytes="):].strip().partition("-")
+    try:
+        if not first:
+            # "bytes=-N" asks for the last N bytes; "bytes=-0" selects nothing and is refused below
+            suffix = int(last)
+            if suffix < 0:
+                raise ValueError
+            start = max(size - suffix, 0) if suffix else size
+            end = size - 1
+        else:
+            start = int(first)
+            end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"},
+        )
+    return start, min(end, size - 1)
+
+async def get_job_package(job: Job) -> ZipPackage:
+    # The package layout is rebuilt if outputs changed on disk or after a restart
+    if job.package is None or not await asyncio.to_thread(job.package.is_unchanged):
+        job.package = await asyncio.to_thread(ZipPackage.from_folder, job.output_folder)
+    return job.package
+
+@app.api_route("/download/{job_id}", methods=["GET", "HEAD"])
+async def download_processed_files(job_id: str, request: Request):
+    job = get_job_or_404(job_id)
+    if job.status != "completed" or not job.output_folder or not os.path.isdir(job.output_folder):
+        logger.error(f"Processed files not available for job {job_id}")
+        raise HTTPException(status_code=404, detail="Processed files not available")
+    package = await get_job_package(job)
+
+    headers = {
+        "Content-Disposition": "attachment; filename=processed_files.zip",
+        "Accept-Ranges": "bytes",
+        "ETag": package.etag,
+    }
+    byte_range = None
+    if request.headers.get("if-range", package.etag) == package.etag:
+        byte_range = parse_range(request.headers.get("range"), package.size)
+    status_code = 200
+    start, end = 0, package.size - 1
+    if byte_range is not None:
+        start, end = byte_range
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{package.size}"
+    headers["Content-Length"] = str(end - start + 1)
+    logger.info(f"Streaming download for job {job_id}: bytes {start}-{end} of {package.size}")
+
+    if request.method == "HEAD":
+        return Response(status_code=status_code, media_type="application/zip", headers=headers)
+    def stream():
+        for chunk in package.iter_range(start, end):
+            DOWNLOAD_BYTES.inc(len(chunk))
+            yield chunk
+
+    return StreamingResponse(
+        stream(),
+        status_code=status_code,
+        media_type="application/zip",
+        headers=headers,
+    )
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,46 @@
+import threading
+
+from log import configure_logging
+from utils import load_config, validate_config
+
+
+class Services:
+    """Process-wide config and shared clients, each created on first use.
+
+    Importing an entry point stays cheap: the config file is read and validated,
+    logging is configured and client libraries are imported only when something
+    first needs them, and the results are reused for the life of the process.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._config = None
+        self._replicate_client = None
+
+    @property
+    def config(self):
+        if self._config is None:
+            with self._lock:
+                if self._config is None:
+                    config = validate_config(load_config())
+                    configure_logging(config)
+                    self._config = config
+        return self._config
+
+    @property
+    def replicate_client(self):
+        if self._replicate_client is None:
+            with self._lock:
+                if self._replicate_client is None:
+                    from replicate_client import ReplicateClient
+
+                    self._replicate_client = ReplicateClient(self.config)
+        return self._replicate_client
+
+    async def aclose(self):
+        if self._replicate_client is not None:
+            await self._replicate_client.aclose()
+            self._replicate_client = None
+
+
+services = Services()
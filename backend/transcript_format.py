@@ -0,0 +1,47 @@
+import json
+
+
+TRANSCRIPT_FORMAT_NOTE = "Each transcript line is formatted as [start-end] text, with times in seconds."
+
+
+def merge_short_segments(transcript, min_seconds=3.0, max_gap=1.0):
+    merged = []
+    for segment in transcript:
+        text = segment['text'].strip()
+        if (
+            merged
+            and merged[-1]['end'] - merged[-1]['start'] < min_seconds
+            and segment['start'] - merged[-1]['end'] <= max_gap
+        ):
+            merged[-1]['end'] = segment['end']
+            merged[-1]['text'] = f"{merged[-1]['text']} {text}"
+        else:
+            merged.append({"start": segment['start'], "end": segment['end'], "text": text})
+    return merged
+
+
+def format_time(seconds, precision):
+    value = f"{seconds:.{precision}f}"
+    if precision:
+        value = value.rstrip('0').rstrip('.')
+    return value
+
+
+def format_transcript(transcript, precision=1, merge_seconds=3.0):
+    if merge_seconds:
+        transcript = merge_short_segments(transcript, merge_seconds)
+    return "\n".join(
+        f"[{format_time(segment['start'], precision)}-{format_time(segment['end'], precision)}] {segment['text'].strip()}"
+        for segment in transcript
+    )
+
+
+def serialize_transcript(transcript, config):
+    if config.get('transcript_prompt_format', 'compact') == 'json':
+        return json.dumps(transcript)
+    lines = format_transcript(
+        transcript,
+        precision=config.get('transcript_time_precision', 1),
+        merge_seconds=config.get('transcript_merge_seconds', 3.0),
+    )
+    return f"{TRANSCRIPT_FORMAT_NOTE}\n{lines}"
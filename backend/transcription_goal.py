@@ -5,4 +5,22 @@ class TranscriptionGoal(Enum):
     PODCAST_SUMMARY = "podcast_summary"
     LECTURE_NOTES = "lecture_notes"
     INTERVIEW_HIGHLIGHTS = "interview_highlights"
-    GENERAL_TRANSCRIPTION = "general_transcription"
\ No newline at end of file
+    GENERAL_TRANSCRIPTION = "general_transcription"
+
+def parse_goals(value):
+    # A goal, a goal name, "name+name" / "name,name", or a list of any of these;
+    # returns the distinct goals in the order given
+    if isinstance(value, TranscriptionGoal):
+        return [value]
+    if isinstance(value, str):
+        names = [name.strip() for name in value.replace(',', '+').split('+')]
+        goals = [TranscriptionGoal(name) for name in names if name]
+    else:
+        goals = [goal for item in value for goal in parse_goals(item)]
+    if not goals:
+        raise ValueError("At least one transcription goal is required")
+    return list(dict.fromkeys(goals))
+
+
+def goals_label(goals):
+    return "+".join(goal.value for goal in goals)
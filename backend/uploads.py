@@ -0,0 +1,147 @@
+import asyncio
+import hashlib
+import os
+
+try:
+    from python_multipart.exceptions import MultipartParseError
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ModuleNotFoundError:
+    from multipart.exceptions import MultipartParseError
+    from multipart.multipart import MultipartParser, parse_options_header
+
+from log import logger
+
+
+# Form fields other than the file are kept in memory, so they are capped
+MAX_FIELD_BYTES = 64 * 1024
+
+
+class UploadTooLargeError(Exception):
+    pass
+
+
+class UploadFormError(Exception):
+    pass
+
+
+class MultipartUpload:
+    """Streaming parser for the upload form.
+
+    The request body is parsed as it arrives: the file part is hashed and
+    written to `directory` in `chunk_size` pieces, and the upload is refused as
+    soon as it passes `max_bytes`, whether or not the client sent a
+    Content-Length. Other fields are collected in `fields` as lists of strings.
+    """
+
+    def __init__(self, content_type, directory, chunk_size, max_bytes=None):
+        _, params = parse_options_header(content_type or "")
+        boundary = params.get(b"boundary")
+        if not boundary:
+            raise UploadFormError("Expected a multipart/form-data body")
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.max_bytes = max_bytes
+        self.fields = {}
+        self.path = None
+        self.size = 0
+        self._sha256 = hashlib.sha256()
+        self._file = None
+        self._pending = []
+        self._pending_size = 0
+        self._headers = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._part_name = None
+        self._part_is_file = False
+        self._field_value = bytearray()
+        self._parser = MultipartParser(boundary, {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        })
+
+    @property
+    def sha256(self):
+        return self._sha256.hexdigest()
+
+    def _on_part_begin(self):
+        self._headers = {}
+        self._field_value = bytearray()
+
+    def _on_header_field(self, data, start, end):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data, start, end):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def _on_headers_finished(self):
+        _, params = parse_options_header(self._headers.get(b"content-disposition", b""))
+        self._part_name = params.get(b"name", b"").decode("utf-8", "replace")
+        filename = params.get(b"filename")
+        self._part_is_file = filename is not None
+        if self._part_is_file:
+            if self.path is not None:
+                raise UploadFormError("Only one file can be uploaded per job")
+            name = os.path.basename(filename.decode("utf-8", "replace").replace("\\", "/"))
+            # Browsers send an empty filename when no file was chosen
+            if name in ("", ".", "..") or "\x00" in name:
+                raise UploadFormError("The uploaded file has no usable filename")
+            self.path = os.path.join(self.directory, name)
+
+    def _on_part_data(self, data, start, end):
+        if not self._part_is_file:
+            self._field_value += data[start:end]
+            if len(self._field_value) > MAX_FIELD_BYTES:
+                raise UploadFormError(f"Form field '{self._part_name}' is too large")
+            return
+        self.size += end - start
+        if self.max_bytes and self.size > self.max_bytes:
+            raise UploadTooLargeError(f"Upload exceeds the maximum size of {self.max_bytes} bytes")
+        chunk = data[start:end]
+        self._sha256.update(chunk)
+        self._pending.append(chunk)
+        self._pending_size += len(chunk)
+
+    def _on_part_end(self):
+        if not self._part_is_file:
+            self.fields.setdefault(self._part_name, []).append(self._field_value.decode("utf-8", "replace"))
+
+    async def _flush(self, force=False):
+        # Parser callbacks only collect data; disk writes happen here, off the event loop
+        if not self._pending or (self._pending_size < self.chunk_size and not force):
+            return
+        if self._file is None:
+            self._file = await asyncio.to_thread(open, self.path, "wb")
+        data = b"".join(self._pending)
+        self._pending = []
+        self._pending_size = 0
+        await asyncio.to_thread(self._file.write, data)
+
+    async def read(self, stream):
+        try:
+            async for chunk in stream:
+                self._parser.write(chunk)
+                await self._flush()
+            self._parser.finalize()
+            await self._flush(force=True)
+        except MultipartParseError as e:
+            raise UploadFormError(f"Malformed multipart body: {str(e)}")
+        finally:
+            if self._file is not None:
+                await asyncio.to_thread(self._file.close)
+        if self.path is None:
+            raise UploadFormError("No file in the upload")
+        if self._file is None:
+            # An empty file never reaches _flush
+            await asyncio.to_thread(lambda: open(self.path, "wb").close())
+        logger.info(f"Spooled {self.size} bytes to {self.path}")
+        return self
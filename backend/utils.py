@@ -1,10 +1,24 @@
 import os
-import yaml
+import hashlib
 import subprocess
-from transcription_goal import TranscriptionGoal
+from transcription_goal import TranscriptionGoal, parse_goals
+
+SUPPORTED_EXTENSIONS = ('.mp4', '.m4a', '.mp3', '.wav', '.avi', '.mov')
+
+# Keys read without a default; a config missing one fails at startup instead of mid-job
+REQUIRED_CONFIG_KEYS = (
+    's3_bucket',
+    'replicate_api_key',
+    'replicate_api_url',
+    'replicate_model_version',
+    'huggingface_token',
+    'anthropic_api_key',
+    'anthropic_api_url',
+    'anthropic_model',
+)
 
 def prompt_for_media_file():
-    supported_extensions = ('.mp4', '.m4a', '.mp3', '.wav', '.avi', '.mov')
+    supported_extensions = SUPPORTED_EXTENSIONS
     while True:
         file_path = input(f"Please enter the full path to the audio or video file {supported_extensions}: ").strip()
         if not file_path:
@@ -15,27 +29,48 @@ def prompt_for_media_file():
         else:
             print(f"Invalid file path or unsupported file type. Please try again.")
 
-def prompt_for_goal():
-    print("Select a transcription goal:")
+def prompt_for_goals():
+    print("Select one or more transcription goals:")
     for i, goal in enumerate(TranscriptionGoal, 1):
         print(f"{i}. {goal.value.replace('_', ' ').title()}")
     
     while True:
         try:
-            choice = int(input("Enter the number of your choice: "))
-            if 1 <= choice <= len(TranscriptionGoal):
-                return list(TranscriptionGoal)[choice - 1]
+            choices = [int(choice) for choice in input("Enter the numbers of your choices, separated by commas: ").split(',')]
+            if all(1 <= choice <= len(TranscriptionGoal) for choice in choices):
+                return parse_goals([list(TranscriptionGoal)[choice - 1] for choice in choices])
             else:
                 print("Invalid choice. Please try again.")
         except ValueError:
-            print("Please enter a number.")
+            print("Please enter numbers separated by commas.")
 
 def execute_shell_command(command):
     process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
     stdout, stderr = process.communicate()
     return stdout.decode('utf-8').strip()
 
+def hash_file(file_path, chunk_size=1024 * 1024):
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+def get_config_path():
+    return os.environ.get('AI_VIDEO_SUMMARIZER_CONFIG') or os.path.join(
+        os.path.dirname(__file__), '..', 'config', 'config.yaml'
+    )
+
 def load_config():
-    config_path = os.path.join(os.path.dirname(__file__), '..', 'config', 'config.yaml')
-    with open(config_path, 'r') as f:
+    import yaml  # only needed once per process, when the config is first read
+
+    with open(get_config_path(), 'r') as f:
         return yaml.safe_load(f)
+
+def validate_config(config):
+    if not isinstance(config, dict):
+        raise ValueError(f"Config file {get_config_path()} does not contain a mapping")
+    missing = [key for key in REQUIRED_CONFIG_KEYS if not config.get(key)]
+    if missing:
+        raise ValueError(f"Config file {get_config_path()} is missing required keys: {', '.join(missing)}")
+    return config
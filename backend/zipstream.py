@@ -0,0 +1,214 @@
+import os
+import struct
+import time
+import zlib
+
+from log import logger
+from metrics import PACKAGE_SECONDS
+
+
+# Text outputs compress well; media clips are already compressed and are stored as-is
+COMPRESSED_EXTENSIONS = ('.txt', '.md', '.json', '.srt', '.vtt', '.csv', '.log')
+
+ZIP64_LIMIT = 0xFFFFFFFF
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+def dos_datetime(timestamp):
+    t = time.localtime(timestamp)
+    year = max(t.tm_year, 1980)
+    return (
+        (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+        ((year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday,
+    )
+
+
+def file_crc32(path):
+    crc = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(READ_CHUNK_SIZE), b''):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+class ZipEntry:
+    def __init__(self, path, arcname):
+        stat = os.stat(path)
+        self.path = path
+        self.arcname = arcname
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        self.data = None
+        if arcname.lower().endswith(COMPRESSED_EXTENSIONS):
+            with open(path, 'rb') as f:
+                raw = f.read()
+            self.crc = zlib.crc32(raw)
+            compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+            self.data = compressor.compress(raw) + compressor.flush()
+            self.compression = 8
+            self.compressed_size = len(self.data)
+        else:
+            self.crc = file_crc32(path)
+            self.compression = 0
+            self.compressed_size = self.size
+        self.offset = 0
+
+    def is_unchanged(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        return stat.st_size == self.size and stat.st_mtime == self.mtime
+
+    @property
+    def zip64(self):
+        return self.size >= ZIP64_LIMIT or self.compressed_size >= ZIP64_LIMIT
+
+    def local_header(self):
+        name = self.arcname.encode('utf-8')
+        mod_time, mod_date = dos_datetime(self.mtime)
+        if self.zip64:
+            extra = struct.pack('<HHQQ', 0x0001, 16, self.size, self.compressed_size)
+            sizes = (ZIP64_LIMIT, ZIP64_LIMIT)
+        else:
+            extra = b''
+            sizes = (self.compressed_size, self.size)
+        return struct.pack(
+            '<IHHHHHIIIHH',
+            0x04034b50,
+            45 if self.zip64 else 20,
+            0x0800,
+            self.compression,
+            mod_time,
+            mod_date,
+            self.crc,
+            *sizes,
+            len(name),
+            len(extra),
+        ) + name + extra
+
+    def central_header(self):
+        name = self.arcname.encode('utf-8')
+        mod_time, mod_date = dos_datetime(self.mtime)
+        extra_fields = []
+        compressed_size, size, offset = self.compressed_size, self.size, self.offset
+        if self.zip64:
+            extra_fields += [self.size, self.compressed_size]
+            compressed_size = size = ZIP64_LIMIT
+        if self.offset >= ZIP64_LIMIT:
+            extra_fields.append(self.offset)
+            offset = ZIP64_LIMIT
+        extra = b''
+        if extra_fields:
+            extra = struct.pack(f'<HH{len(extra_fields)}Q', 0x0001, 8 * len(extra_fields), *extra_fields)
+        needs_zip64 = bool(extra_fields)
+        return struct.pack(
+            '<IHHHHHHIIIHHHHHII',
+            0x02014b50,
+            (3 << 8) | (45 if needs_zip64 else 20),
+            45 if needs_zip64 else 20,
+            0x0800,
+            self.compression,
+            mod_time,
+            mod_date,
+            self.crc,
+            compressed_size,
+            size,
+            len(name),
+            len(extra),
+            0,
+            0,
+            0,
+            0o100644 << 16,
+            offset,
+        ) + name + extra
+
+
+def end_records(entry_count, cd_offset, cd_size):
+    records = b''
+    if entry_count >= 0xFFFF or cd_offset >= ZIP64_LIMIT or cd_size >= ZIP64_LIMIT:
+        zip64_end_offset = cd_offset + cd_size
+        records += struct.pack(
+            '<IQHHIIQQQQ', 0x06064b50, 44, 45, 45, 0, 0, entry_count, entry_count, cd_size, cd_offset
+        )
+        records += struct.pack('<IIQI', 0x07064b50, 0, zip64_end_offset, 1)
+        entry_count = min(entry_count, 0xFFFF)
+        cd_offset = min(cd_offset, ZIP64_LIMIT)
+        cd_size = min(cd_size, ZIP64_LIMIT)
+    records += struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, entry_count, entry_count, cd_size, cd_offset, 0)
+    return records
+
+
+class ZipPackage:
+    """Byte-exact layout of a zip archive over files on disk, streamed on demand.
+
+    CRCs and compressed text are computed once up front, so the archive size is
+    known and any byte range can be produced without writing the archive.
+    """
+
+    def __init__(self, entries):
+        self.entries = entries
+        # (length, bytes or (path, start)) pieces making up the archive, in order
+        self.segments = []
+        offset = 0
+        for entry in entries:
+            entry.offset = offset
+            header = entry.local_header()
+            self.segments.append((len(header), header))
+            if entry.data is not None:
+                self.segments.append((entry.compressed_size, entry.data))
+            else:
+                self.segments.append((entry.size, (entry.path, 0)))
+            offset += len(header) + entry.compressed_size
+        central_directory = b''.join(entry.central_header() for entry in entries)
+        self.segments.append((len(central_directory), central_directory))
+        tail = end_records(len(entries), offset, len(central_directory))
+        self.segments.append((len(tail), tail))
+        self.size = offset + len(central_directory) + len(tail)
+        self.etag = f'"{zlib.crc32(central_directory):08x}-{self.size:x}"'
+
+    @classmethod
+    def from_folder(cls, folder):
+        started = time.monotonic()
+        entries = []
+        for root, _, files in os.walk(folder):
+            for file in sorted(files):
+                file_path = os.path.join(root, file)
+                entries.append(ZipEntry(file_path, os.path.relpath(file_path, folder)))
+        package = cls(entries)
+        PACKAGE_SECONDS.observe(time.monotonic() - started)
+        logger.info(
+            f"Indexed {len(entries)} files for download from {folder}: "
+            f"{package.size} bytes in {time.monotonic() - started:.2f}s"
+        )
+        return package
+
+    def is_unchanged(self):
+        return all(entry.is_unchanged() for entry in self.entries)
+
+    def iter_range(self, start=0, end=None, chunk_size=READ_CHUNK_SIZE):
+        # Yields bytes [start, end] (inclusive) of the archive
+        end = self.size - 1 if end is None else min(end, self.size - 1)
+        position = 0
+        for length, source in self.segments:
+            segment_start, segment_end = position, position + length - 1
+            position += length
+            if segment_end < start or length == 0:
+                continue
+            if segment_start > end:
+                break
+            first = max(start, segment_start) - segment_start
+            last = min(end, segment_end) - segment_start
+            if isinstance(source, bytes):
+                yield source[first:last + 1]
+                continue
+            path, base = source
+            with open(path, 'rb') as f:
+                f.seek(base + first)
+                remaining = last - first + 1
+                while remaining > 0:
+                    chunk = f.read(min(chunk_size, remaining))
+                    if not chunk:
+                        raise IOError(f"{path} was truncated while streaming")
+                    remaining -= len(chunk)
+                    yield chunk
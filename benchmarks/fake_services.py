@@ -0,0 +1,423 @@
+"""Local stand-ins for S3, Replicate and the Anthropic Messages API.
+
+One threaded HTTP server answers all three under different path prefixes:
+
+    /replicate/v1/predictions   Replicate predictions (create, get, cancel)
+    /anthropic/v1/messages      Anthropic messages
+    /<bucket>/<key>             S3, path-style: PutObject, multipart upload, GetObject
+
+Each service has its own latency, jitter and injected failure rate, and the
+server counts requests, failures and bytes received and sent per service.
+Transcripts are synthetic and sized to `media_seconds`, so the clip times
+returned by the fake LLM always fall inside the generated media.
+"""
+import hashlib
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+import urllib.request
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from transcript_encoding import synthetic_transcript
+
+
+DEFAULT_SETTINGS = {
+    "s3": {"latency": 0.005, "jitter": 0.0, "failure_rate": 0.0},
+    "replicate": {
+        "latency": 0.02,
+        "jitter": 0.0,
+        "failure_rate": 0.0,
+        # Time from prediction creation to success, as a fraction of the media duration plus a fixed part
+        "processing_seconds": 1.0,
+        "realtime_factor": 0.01,
+        "prediction_failure_rate": 0.0,
+        "download_audio": True,
+    },
+    "anthropic": {
+        "latency": 0.2,
+        "jitter": 0.05,
+        "failure_rate": 0.0,
+        "output_tokens": 800,
+        "tokens_per_second": 400,
+        "topics": 4,
+        # Fraction of topic and clip responses wrapped in prose, cut off or given a broken entry
+        "malformed_rate": 0.0,
+    },
+}
+
+LOREM = (
+    "The team reviewed the launch plan and agreed on the next steps for the release. "
+    "Budget questions were raised about the customer feedback programme and the data model. "
+)
+
+
+class ServiceStats:
+    def __init__(self):
+        self.requests = 0
+        self.failures = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+class FakeServices:
+    def __init__(self, settings=None, host='127.0.0.1', port=0, seed=0):
+        self.settings = {name: dict(values) for name, values in DEFAULT_SETTINGS.items()}
+        self.configure(settings or {})
+        self.media_seconds = 60.0
+        self.random = random.Random(seed)
+        self.stats = {name: ServiceStats() for name in self.settings}
+        self.predictions = {}
+        self.uploads = {}
+        self.object_dir = tempfile.mkdtemp(prefix='fake-s3-')
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), make_handler(self))
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def configure(self, settings):
+        for name, values in settings.items():
+            self.settings[name].update(values)
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats = {name: ServiceStats() for name in self.settings}
+
+    def snapshot(self):
+        with self._lock:
+            return {name: stats.as_dict() for name, stats in self.stats.items()}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-services', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def config_overrides(self, bucket='benchmark'):
+        # Keys merged into the pipeline config so every client talks to this server
+        return {
+            "s3_bucket": bucket,
+            "s3_endpoint_url": self.url,
+            "s3_addressing_style": "path",
+            "aws_region": "us-east-1",
+            "aws_access_key_id": "benchmark",
+            "aws_secret_access_key": "benchmark",
+            "replicate_api_key": "benchmark",
+            "replicate_api_url": f"{self.url}/replicate/v1/predictions",
+            "replicate_model_version": "benchmark",
+            "huggingface_token": "benchmark",
+            "anthropic_api_key": "benchmark",
+            "anthropic_api_url": f"{self.url}/anthropic/v1/messages",
+            "anthropic_model": "benchmark",
+        }
+
+    def count(self, service, bytes_in=0, bytes_out=0, failed=False):
+        with self._lock:
+            stats = self.stats[service]
+            stats.requests += 1
+            stats.failures += int(failed)
+            stats.bytes_in += bytes_in
+            stats.bytes_out += bytes_out
+
+    def delay(self, service):
+        settings = self.settings[service]
+        seconds = settings["latency"] + self.random.uniform(0, settings["jitter"])
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def should_fail(self, service):
+        return self.random.random() < self.settings[service]["failure_rate"]
+
+    def object_path(self, bucket, key):
+        return os.path.join(self.object_dir, hashlib.sha256(f"{bucket}/{key}".encode()).hexdigest())
+
+    def create_prediction(self, body):
+        settings = self.settings["replicate"]
+        prediction_id = uuid.uuid4().hex
+        ready_in = settings["processing_seconds"] + settings["realtime_factor"] * self.media_seconds
+        prediction = {
+            "id": prediction_id,
+            "status": "starting",
+            "input": body.get("input", {}),
+            "urls": {
+                "get": f"{self.url}/replicate/v1/predictions/{prediction_id}",
+                "cancel": f"{self.url}/replicate/v1/predictions/{prediction_id}/cancel",
+            },
+            "ready_at": time.monotonic() + ready_in,
+            "fails": self.random.random() < settings["prediction_failure_rate"],
+        }
+        audio_url = prediction["input"].get("audio_file")
+        if settings["download_audio"] and audio_url:
+            threading.Thread(target=self.download_audio, args=(audio_url,), daemon=True).start()
+        with self._lock:
+            self.predictions[prediction_id] = prediction
+        return public_prediction(prediction)
+
+    def download_audio(self, url):
+        # Stands in for the model fetching the presigned upload, so those bytes are counted too
+        try:
+            with urllib.request.urlopen(url) as response:
+                while response.read(1024 * 1024):
+                    pass
+        except OSError:
+            pass
+
+    def get_prediction(self, prediction_id):
+        with self._lock:
+            prediction = self.predictions.get(prediction_id)
+        if prediction is None:
+            return None
+        if prediction["status"] in ("starting", "processing"):
+            if time.monotonic() < prediction["ready_at"]:
+                prediction["status"] = "processing"
+            elif prediction["fails"]:
+                prediction["status"] = "failed"
+                prediction["error"] = "Injected prediction failure"
+            else:
+                prediction["status"] = "succeeded"
+                transcript = synthetic_transcript(self.media_seconds / 60)
+                prediction["output"] = {"segments": [s for s in transcript if s["end"] <= self.media_seconds]}
+        return public_prediction(prediction)
+
+    def malform(self, text):
+        # Failure modes seen in real responses
+        items = json.loads(text)
+        mode = self.random.choice(("prose", "truncated", "broken_entry"))
+        if mode == "prose":
+            return f"Here is the JSON you asked for:\n\n```json\n{json.dumps(items, indent=2)}\n```\n\nLet me know if you need changes."
+        if mode == "truncated":
+            return text[:len(text) * 2 // 3]
+        if "end" in items[0]:
+            items[0]["end"] = "until the end of the discussion"
+            return json.dumps(items)
+        # An unquoted key makes the first topic invalid JSON
+        return text.replace('"title": ', 'title: ', 1)
+
+    def message(self, body, generate=True):
+        # Picks a response shape from the prompt the pipeline sent. With
+        # generate=False the caller paces the output itself (streaming)
+        settings = self.settings["anthropic"]
+        prompt = body["messages"][0]["content"]
+        if "'title' and 'keywords'" in prompt:
+            text = json.dumps([
+                {"title": f"Topic {index + 1}", "keywords": ["launch", "budget", "customer", "data"]}
+                for index in range(settings["topics"])
+            ])
+        elif "Start time of the clip" in prompt:
+            titles = re.findall(r'"title": "([^"]+)"', prompt) or ["Topic 1"]
+            span = self.media_seconds / len(titles)
+            text = json.dumps([
+                {"title": title, "start": round(index * span, 1), "end": round(min((index + 0.8) * span, self.media_seconds), 1)}
+                for index, title in enumerate(titles)
+            ])
+        else:
+            words = min(settings["output_tokens"], body.get("max_tokens", 4000)) * 3 // 4
+            repeated = (LOREM * (words // len(LOREM.split()) + 1)).split()[:words]
+            text = "# Summary\n\n" + " ".join(repeated)
+        if text.startswith("[") and self.random.random() < settings["malformed_rate"]:
+            text = self.malform(text)
+        output_tokens = len(text) // 4 + 1
+        if generate and settings["tokens_per_second"]:
+            time.sleep(output_tokens / settings["tokens_per_second"])
+        return {
+            "id": f"msg_{uuid.uuid4().hex}",
+            "type": "message",
+            "role": "assistant",
+            "model": body.get("model"),
+            "content": [{"type": "text", "text": text}],
+            "stop_reason": "end_turn",
+            "usage": {"input_tokens": len(prompt) // 4 + 1, "output_tokens": output_tokens},
+        }
+
+
+def public_prediction(prediction):
+    return {key: value for key, value in prediction.items() if key not in ("ready_at", "fails")}
+
+
+def make_handler(services):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        @property
+        def service(self):
+            if self.path.startswith('/replicate/'):
+                return 'replicate'
+            if self.path.startswith('/anthropic/'):
+                return 'anthropic'
+            return 's3'
+
+        def read_body(self):
+            if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+                body = b''
+                while True:
+                    size = int(self.rfile.readline().split(b';')[0].strip(), 16)
+                    if size == 0:
+                        while self.rfile.readline().strip():
+                            pass
+                        break
+                    body += self.rfile.read(size)
+                    self.rfile.readline()
+            else:
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if 'aws-chunked' in self.headers.get('Content-Encoding', ''):
+                body = decode_aws_chunked(body)
+            return body
+
+        def respond(self, status, body=b'', content_type='application/json', headers=None, bytes_in=0):
+            if isinstance(body, (dict, list)):
+                body = json.dumps(body).encode()
+            elif isinstance(body, str):
+                body = body.encode()
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            if self.command != 'HEAD':
+                self.wfile.write(body)
+            services.count(self.service, bytes_in, len(body), failed=status >= 500)
+
+        def handle_request(self):
+            body = self.read_body() if self.command in ('POST', 'PUT') else b''
+            services.delay(self.service)
+            if services.should_fail(self.service):
+                if self.service == 's3':
+                    error = '<Error><Code>InternalError</Code><Message>Injected failure</Message></Error>'
+                    return self.respond(500, error, 'application/xml', bytes_in=len(body))
+                return self.respond(500, {"error": "Injected failure"}, bytes_in=len(body))
+            handler = {'replicate': self.handle_replicate, 'anthropic': self.handle_anthropic}.get(self.service, self.handle_s3)
+            handler(body)
+
+        do_GET = do_PUT = do_POST = do_DELETE = do_HEAD = handle_request
+
+        def handle_replicate(self, body):
+            parts = urlsplit(self.path).path.strip('/').split('/')
+            if self.command == 'POST' and len(parts) == 3:
+                return self.respond(201, services.create_prediction(json.loads(body)), bytes_in=len(body))
+            prediction = services.get_prediction(parts[3]) if len(parts) > 3 else None
+            if prediction is None:
+                return self.respond(404, {"detail": "Not found"})
+            if parts[-1] == 'cancel':
+                prediction["status"] = "canceled"
+                services.predictions[prediction["id"]]["status"] = "canceled"
+            self.respond(200, prediction, bytes_in=len(body))
+
+        def handle_anthropic(self, body):
+            request = json.loads(body)
+            if not request.get("stream"):
+                return self.respond(200, services.message(request), bytes_in=len(body))
+            message = services.message(request, generate=False)
+            text = message["content"][0]["text"]
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            self.close_connection = True
+            sent = 0
+
+            def send(event, data):
+                nonlocal sent
+                chunk = f"event: {event}\ndata: {json.dumps({'type': event, **data})}\n\n".encode()
+                self.wfile.write(chunk)
+                self.wfile.flush()
+                sent += len(chunk)
+
+            tokens_per_second = services.settings["anthropic"]["tokens_per_second"]
+            start_message = {**message, "content": [], "usage": {**message["usage"], "output_tokens": 1}}
+            send("message_start", {"message": start_message})
+            send("content_block_start", {"index": 0, "content_block": {"type": "text", "text": ""}})
+            # About 20 tokens per delta, paced like the non-streaming response
+            for offset in range(0, len(text), 80):
+                if tokens_per_second:
+                    time.sleep(20 / tokens_per_second)
+                send("content_block_delta", {"index": 0, "delta": {"type": "text_delta", "text": text[offset:offset + 80]}})
+            send("content_block_stop", {"index": 0})
+            send("message_delta", {"delta": {"stop_reason": "end_turn"}, "usage": {"output_tokens": message["usage"]["output_tokens"]}})
+            send("message_stop", {})
+            services.count(self.service, len(body), sent)
+
+        def handle_s3(self, body):
+            url = urlsplit(self.path)
+            query = parse_qs(url.query, keep_blank_values=True)
+            bucket, _, key = url.path.lstrip('/').partition('/')
+            path = services.object_path(bucket, key)
+            if self.command == 'POST' and 'uploads' in query:
+                upload_id = uuid.uuid4().hex
+                services.uploads[upload_id] = {}
+                result = (
+                    '<?xml version="1.0" encoding="UTF-8"?><InitiateMultipartUploadResult>'
+                    f'<Bucket>{bucket}</Bucket><Key>{key}</Key><UploadId>{upload_id}</UploadId>'
+                    '</InitiateMultipartUploadResult>'
+                )
+                return self.respond(200, result, 'application/xml')
+            if self.command == 'PUT' and 'uploadId' in query:
+                etag = f'"{hashlib.md5(body).hexdigest()}"'
+                services.uploads[query['uploadId'][0]][int(query['partNumber'][0])] = body
+                return self.respond(200, headers={'ETag': etag}, bytes_in=len(body))
+            if self.command == 'POST' and 'uploadId' in query:
+                parts = services.uploads.pop(query['uploadId'][0])
+                with open(path, 'wb') as f:
+                    for number in sorted(parts):
+                        f.write(parts[number])
+                result = (
+                    '<?xml version="1.0" encoding="UTF-8"?><CompleteMultipartUploadResult>'
+                    f'<Location>{services.url}/{bucket}/{key}</Location><Bucket>{bucket}</Bucket>'
+                    f'<Key>{key}</Key><ETag>"{uuid.uuid4().hex}-{len(parts)}"</ETag>'
+                    '</CompleteMultipartUploadResult>'
+                )
+                return self.respond(200, result, 'application/xml', bytes_in=len(body))
+            if self.command == 'DELETE' and 'uploadId' in query:
+                services.uploads.pop(query['uploadId'][0], None)
+                return self.respond(204)
+            if self.command == 'PUT':
+                with open(path, 'wb') as f:
+                    f.write(body)
+                return self.respond(200, headers={'ETag': f'"{hashlib.md5(body).hexdigest()}"'}, bytes_in=len(body))
+            if self.command in ('GET', 'HEAD'):
+                if not os.path.exists(path):
+                    error = '<Error><Code>NoSuchKey</Code><Message>Not found</Message></Error>'
+                    return self.respond(404, error, 'application/xml')
+                with open(path, 'rb') as f:
+                    return self.respond(200, f.read(), 'application/octet-stream')
+            self.respond(405, '', 'application/xml')
+
+    return Handler
+
+
+def decode_aws_chunked(body):
+    # "<hex size>[;chunk-signature=...]\r\n<data>\r\n" repeated, ending with a zero-size chunk and trailers
+    decoded, position = b'', 0
+    while position < len(body):
+        line_end = body.index(b'\r\n', position)
+        size = int(body[position:line_end].split(b';')[0], 16)
+        if size == 0:
+            break
+        decoded += body[line_end + 2:line_end + 2 + size]
+        position = line_end + 2 + size + 2
+    return decoded
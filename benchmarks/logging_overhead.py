@@ -0,0 +1,137 @@
+"""Measure the logging cost a job pays on its own threads.
+
+Usage: python benchmarks/logging_overhead.py [--jobs 20]
+
+Replays the log traffic of one long job: progress updates, per-clip
+commands, and the API response bodies and AI texts that used to be dumped
+in full at DEBUG. It compares three setups:
+
+  legacy       the previous log.py: synchronous RotatingFileHandler and
+               console output, payloads formatted eagerly with f-strings
+  development  queue-backed logging, payloads capped and formatted lazily
+  production   queue-backed logging at INFO, JSON log file, no payloads
+
+Reports the time spent in the calling thread per job and the bytes written
+to the log file. Console output goes to /dev/null for every setup.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from logging.handlers import RotatingFileHandler
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+import log  # noqa: E402
+from log import bind_log_context, configure_logging, log_payload, stop_logging  # noqa: E402
+
+
+def synthetic_payloads():
+    # Sizes typical of a one-hour recording
+    transcript_segments = [
+        {"start": i * 4.2, "end": i * 4.2 + 3.9, "text": " and then we talked about the release plan for next week"}
+        for i in range(900)
+    ]
+    replicate_response = json.dumps({"id": "abc", "status": "succeeded", "output": {"segments": transcript_segments}})
+    content = "# Meeting minutes\n\n" + "- The team agreed to move the launch by one week.\n" * 400
+    anthropic_response = json.dumps({"content": [{"type": "text", "text": content}], "usage": {"output_tokens": 4000}})
+    topics = json.dumps([{"title": f"Topic {i}", "keywords": ["launch", "budget"]} for i in range(8)])
+    return replicate_response, anthropic_response, content, topics
+
+
+def legacy_job(logger, payloads):
+    replicate_response, anthropic_response, content, topics = payloads
+    for percent in range(100):
+        logger.info(f"Job 1234 - Status Update: processing - Progress: {percent}% - Message: Uploading media to S3 ({percent}%)")
+    logger.debug(f"Replicate API response: {replicate_response}")
+    for _ in range(3):
+        logger.debug(f"Anthropic API response: {anthropic_response}")
+    logger.debug(f"Full AI response for content generation:\n{content}")
+    logger.debug(f"Full AI response for topic extraction:\n{topics}")
+    for index in range(8):
+        command = ["ffmpeg", "-hide_banner", "-ss", f"{index * 60:.2f}", "-i", "input.mp4", "-t", "60.00", f"clip_{index}.mp4"]
+        logger.debug(f"Executing command: {' '.join(command)}")
+
+
+def current_job(logger, payloads):
+    replicate_response, anthropic_response, content, topics = payloads
+    with bind_log_context(job_id="1234", goal="meeting_minutes"):
+        for percent in range(100):
+            logger.info(f"Job 1234 - Status Update: processing - Progress: {percent}% - Message: Uploading media to S3 ({percent}%)")
+        log_payload("Replicate API response", lambda: replicate_response)
+        for _ in range(3):
+            log_payload("Anthropic API response", lambda: anthropic_response)
+        log_payload("AI response for content generation", content)
+        log_payload("AI response for topic extraction", topics)
+        for index in range(8):
+            command = ["ffmpeg", "-hide_banner", "-ss", f"{index * 60:.2f}", "-i", "input.mp4", "-t", "60.00", f"clip_{index}.mp4"]
+            logger.debug("Executing command: %s", command)
+
+
+def configure_legacy(log_file, console):
+    stop_logging()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    file_handler = RotatingFileHandler(log_file, maxBytes=10000000, backupCount=5)
+    console_handler = logging.StreamHandler(console)
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    for handler in (file_handler, console_handler):
+        handler.setFormatter(formatter)
+        root.addHandler(handler)
+    root.setLevel(logging.INFO)
+    log.logger.setLevel(logging.DEBUG)
+    return [file_handler, console_handler]
+
+
+def measure(name, jobs, run_job, setup):
+    directory = tempfile.mkdtemp(prefix='logging-overhead-')
+    log_file = os.path.join(directory, 'debug.log')
+    payloads = synthetic_payloads()
+    with open(os.devnull, 'w') as console:
+        stderr, sys.stderr = sys.stderr, console
+        try:
+            handlers = setup(log_file, console)
+            started = time.perf_counter()
+            for _ in range(jobs):
+                run_job(log.logger, payloads)
+            caller_seconds = time.perf_counter() - started
+            stop_logging()
+            for handler in handlers or []:
+                handler.close()
+            total_seconds = time.perf_counter() - started
+        finally:
+            sys.stderr = stderr
+    written = sum(os.path.getsize(os.path.join(directory, f)) for f in os.listdir(directory))
+    print(
+        f"{name:<12}{caller_seconds / jobs * 1000:>12.2f} ms{total_seconds / jobs * 1000:>14.2f} ms"
+        f"{written / jobs / 1024:>14.1f} KiB"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--jobs", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'setup':<12}{'caller/job':>15}{'incl. flush':>17}{'log file/job':>18}")
+    measure("legacy", args.jobs, legacy_job, configure_legacy)
+    measure(
+        "development",
+        args.jobs,
+        current_job,
+        lambda log_file, console: configure_logging({"log_profile": "development", "log_file": log_file}),
+    )
+    measure(
+        "production",
+        args.jobs,
+        current_job,
+        lambda log_file, console: configure_logging({"log_profile": "production", "log_file": log_file}),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,415 @@
+"""End-to-end pipeline benchmark against local stand-ins for S3, Replicate and Anthropic.
+
+Usage:
+    python benchmarks/pipeline_e2e.py [--scenarios scenarios.json] [--only NAME ...]
+                                      [--output results.json] [--compare previous.json]
+
+Each scenario generates small synthetic media files with ffmpeg, then runs them
+through `cli.main` or `server.process_media` (via the server's job manager) in a
+fresh subprocess, so peak RSS is measured per scenario. All network services
+are answered by benchmarks/fake_services.py with the latency and failure
+injection given in the scenario. Results are written as JSON, by default to
+benchmarks/results/, and `--compare` prints the change against an earlier run.
+
+A scenario is a JSON object such as:
+
+    {"name": "server-4-jobs", "entry_point": "server", "media_seconds": 300, "jobs": 4,
+     "config": {"max_concurrent_jobs": 2}, "services": {"s3": {"failure_rate": 0.05}}}
+
+`config` is merged into the pipeline config and `services` into the fake
+service settings (see fake_services.DEFAULT_SETTINGS).
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import yaml
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+BACKEND_DIR = os.path.join(REPO_DIR, 'backend')
+sys.path.insert(0, BENCHMARK_DIR)
+
+from fake_services import FakeServices  # noqa: E402
+
+
+SCENARIOS = [
+    {"name": "cli-1min", "entry_point": "cli", "media_seconds": 60},
+    {"name": "cli-10min", "entry_point": "cli", "media_seconds": 600},
+    {
+        "name": "cli-60min-map-reduce",
+        "entry_point": "cli",
+        "media_seconds": 3600,
+        "config": {"summary_chunk_tokens": 8000},
+    },
+    {
+        "name": "cli-10min-3-goals",
+        "entry_point": "cli",
+        "media_seconds": 600,
+        "goals": ["meeting_minutes", "interview_highlights", "lecture_notes"],
+    },
+    {
+        "name": "cli-original-upload",
+        "entry_point": "cli",
+        "media_seconds": 600,
+        "config": {"extract_audio": False},
+    },
+    {
+        # Topic and clip responses wrapped in prose, cut off or with a broken entry
+        "name": "cli-10min-malformed-json",
+        "entry_point": "cli",
+        "media_seconds": 600,
+        "services": {"anthropic": {"malformed_rate": 0.5}},
+    },
+    {
+        "name": "server-4-jobs",
+        "entry_point": "server",
+        "media_seconds": 300,
+        "jobs": 4,
+        "config": {"max_concurrent_jobs": 2},
+    },
+    {
+        "name": "server-4-jobs-flaky",
+        "entry_point": "server",
+        "media_seconds": 300,
+        "jobs": 4,
+        "config": {"max_concurrent_jobs": 4},
+        "services": {"s3": {"failure_rate": 0.05}, "anthropic": {"latency": 1.0, "jitter": 0.5}},
+    },
+]
+
+BASE_CONFIG = {
+    # Small parts so the multipart upload path is exercised with small media
+    "s3_multipart_threshold": 5 * 1024 * 1024,
+    "s3_part_size": 5 * 1024 * 1024,
+    "replicate_poll_initial_interval": 0.2,
+    "replicate_poll_max_interval": 1.0,
+    "transcription_timeout": 600,
+}
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def generate_media(path, seconds, variant, ffmpeg_path):
+    # A tiny video track and a tone per variant, so every job gets distinct media (and hashes)
+    if os.path.exists(path):
+        return path
+    command = [
+        ffmpeg_path, "-hide_banner", "-loglevel", "error",
+        "-f", "lavfi", "-i", "color=c=gray:s=160x90:r=2",
+        "-f", "lavfi", "-i", f"sine=frequency={220 + 55 * variant}:sample_rate=16000",
+        "-t", str(seconds),
+        "-c:v", "mpeg4", "-q:v", "31",
+        "-c:a", "aac", "-b:a", "32k",
+        "-shortest", "-y", path,
+    ]
+    subprocess.run(command, capture_output=True, text=True, check=True)
+    return path
+
+
+def folder_size(folder):
+    return sum(
+        os.path.getsize(os.path.join(root, file))
+        for root, _, files in os.walk(folder)
+        for file in files
+    )
+
+
+def summarize_timings(job_timings):
+    stages = {}
+    for timings in job_timings:
+        for name, seconds in timings.items():
+            stages.setdefault(name, []).append(seconds)
+    return {
+        name: {"mean": round(sum(values) / len(values), 4), "max": round(max(values), 4), "count": len(values)}
+        for name, values in stages.items()
+    }
+
+
+def peak_rss():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return (
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale,
+    )
+
+
+def run_cli_jobs(media_files, goals):
+    import cli
+    results = []
+    for media_file in media_files:
+        started = time.monotonic()
+        try:
+            pipeline = cli.main(media_file, goals, use_cache=False, resume=False)
+            results.append({"timings": pipeline.timings, "error": None})
+        except Exception as e:
+            results.append({"timings": {}, "error": str(e)})
+        results[-1]["seconds"] = time.monotonic() - started
+    return results
+
+
+async def run_server_jobs(media_files, goals):
+    import server
+    from jobs import Job
+    from utils import hash_file
+
+    job_manager = server.get_job_manager()
+    job_manager.start()
+    jobs = []
+    for media_file in media_files:
+        # Same steps as the upload route, minus the HTTP transfer
+        job = Job(goals)
+        job.use_cache = False
+        job.work_dir = os.path.join(server.get_spool_dir(), job.id)
+        os.makedirs(job.work_dir, exist_ok=True)
+        job.media_file = os.path.join(job.work_dir, os.path.basename(media_file))
+        shutil.copy(media_file, job.media_file)
+        job.media_hash = hash_file(job.media_file)
+        job.media_size = os.path.getsize(job.media_file)
+        job_manager.submit(job)
+        jobs.append(job)
+    while not all(job.finished for job in jobs):
+        await asyncio.sleep(0.05)
+    await job_manager.stop()
+    await server.services.aclose()
+    return [
+        {
+            "timings": job.timings,
+            "error": None if job.status == "completed" else job.message,
+            "seconds": job.finished_at - job.submitted_at,
+            "queue_seconds": (job.started_at or job.finished_at) - job.submitted_at,
+        }
+        for job in jobs
+    ]
+
+
+def run_child(spec_path):
+    # Runs inside the scenario subprocess, with the config path in the environment
+    with open(spec_path) as f:
+        spec = json.load(f)
+    sys.path.insert(0, BACKEND_DIR)
+    from transcription_goal import parse_goals
+
+    goals = parse_goals(spec["goals"])
+    started = time.monotonic()
+    if spec["entry_point"] == "server":
+        jobs = asyncio.run(run_server_jobs(spec["media_files"], goals))
+        output_root = spec["spool_dir"]
+    else:
+        jobs = run_cli_jobs(spec["media_files"], goals)
+        output_root = spec["media_dir"]
+    wall_seconds = time.monotonic() - started
+    rss, child_rss = peak_rss()
+    result = {
+        "wall_seconds": round(wall_seconds, 4),
+        "peak_rss_bytes": rss,
+        "peak_child_rss_bytes": child_rss,
+        "output_bytes": folder_size(output_root),
+        "jobs": jobs,
+    }
+    with open(spec["result_path"], 'w') as f:
+        json.dump(result, f)
+
+
+def run_scenario(scenario, services, base_config, work_dir, ffmpeg_path, verbose=False):
+    name = scenario["name"]
+    scenario_dir = os.path.join(work_dir, name)
+    shutil.rmtree(scenario_dir, ignore_errors=True)
+    media_dir = os.path.join(scenario_dir, 'media')
+    os.makedirs(media_dir)
+
+    seconds = scenario.get("media_seconds", 60)
+    job_count = scenario.get("jobs", 1)
+    media_files = []
+    for variant in range(job_count):
+        source = generate_media(
+            os.path.join(work_dir, 'media', f"media-{seconds}s-{variant}.mp4"), seconds, variant, ffmpeg_path
+        )
+        # The CLI writes its outputs next to the media file, so each scenario works on a copy
+        media_files.append(shutil.copy(source, media_dir))
+
+    config = {
+        **base_config,
+        "cache_dir": os.path.join(scenario_dir, 'cache'),
+        "spool_dir": os.path.join(scenario_dir, 'spool'),
+        "max_queued_jobs": max(job_count, 8),
+        "log_console_level": "INFO" if verbose else "WARNING",
+        **scenario.get("config", {}),
+        **services.config_overrides(),
+    }
+    config_path = os.path.join(scenario_dir, 'config.yaml')
+    with open(config_path, 'w') as f:
+        yaml.safe_dump(config, f)
+    spec_path = os.path.join(scenario_dir, 'spec.json')
+    result_path = os.path.join(scenario_dir, 'result.json')
+    with open(spec_path, 'w') as f:
+        json.dump({
+            "entry_point": scenario.get("entry_point", "cli"),
+            "goals": scenario.get("goals", "general_transcription"),
+            "media_files": media_files,
+            "media_dir": media_dir,
+            "spool_dir": config["spool_dir"],
+            "result_path": result_path,
+        }, f)
+
+    services.configure(scenario.get("services", {}))
+    services.media_seconds = seconds
+    services.reset_stats()
+    print(f"Running {name}: {scenario.get('entry_point', 'cli')}, {job_count} x {seconds}s media", flush=True)
+    subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", spec_path],
+        cwd=scenario_dir,
+        env={**os.environ, "AI_VIDEO_SUMMARIZER_CONFIG": config_path},
+        check=True,
+    )
+    with open(result_path) as f:
+        result = json.load(f)
+
+    service_stats = services.snapshot()
+    completed = [job for job in result["jobs"] if job["error"] is None]
+    wall_hours = max(result["wall_seconds"], 1e-9) / 3600
+    return {
+        "name": name,
+        "scenario": scenario,
+        "wall_seconds": result["wall_seconds"],
+        "jobs": len(result["jobs"]),
+        "completed_jobs": len(completed),
+        "errors": [job["error"] for job in result["jobs"] if job["error"]],
+        "job_seconds": [round(job["seconds"], 4) for job in result["jobs"]],
+        # Includes calls repeated after unusable responses and failed jobs
+        "llm_requests_per_job": round(service_stats["anthropic"]["requests"] / max(len(result["jobs"]), 1), 2),
+        "throughput": {
+            "jobs_per_hour": round(len(completed) / wall_hours, 2),
+            "media_hours_per_hour": round(len(completed) * seconds / 3600 / wall_hours, 2),
+        },
+        "stages": summarize_timings([job["timings"] for job in result["jobs"]]),
+        "peak_rss_bytes": result["peak_rss_bytes"],
+        "peak_child_rss_bytes": result["peak_child_rss_bytes"],
+        "bytes": {
+            "media_in": sum(os.path.getsize(path) for path in media_files),
+            "outputs": result["output_bytes"],
+            **{
+                f"{service}_{direction}": stats[f"bytes_{direction}"]
+                for service, stats in service_stats.items()
+                for direction in ("in", "out")
+            },
+        },
+        "services": service_stats,
+    }
+
+
+def print_result(result):
+    print(
+        f"  {result['completed_jobs']}/{result['jobs']} jobs in {result['wall_seconds']:.2f}s, "
+        f"{result['throughput']['jobs_per_hour']:.1f} jobs/hour, "
+        f"{result['llm_requests_per_job']:.1f} LLM requests/job, "
+        f"peak RSS {result['peak_rss_bytes'] / 2**20:.1f} MiB (ffmpeg {result['peak_child_rss_bytes'] / 2**20:.1f} MiB)"
+    )
+    for name, stage in result["stages"].items():
+        print(f"    {name:<20}{stage['mean']:>10.3f}s mean{stage['max']:>10.3f}s max")
+    moved = {key: value for key, value in result["bytes"].items() if value}
+    print(f"    bytes: {moved}")
+    for error in result["errors"]:
+        print(f"    error: {error}")
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {scenario["name"]: scenario for scenario in json.load(f)["scenarios"]}
+    print(f"\nCompared with {baseline_path}:")
+    for result in results:
+        previous = baseline.get(result["name"])
+        if previous is None:
+            continue
+        rows = [("wall", previous["wall_seconds"], result["wall_seconds"])]
+        rows += [
+            (name, previous["stages"][name]["mean"], stage["mean"])
+            for name, stage in result["stages"].items()
+            if name in previous["stages"]
+        ]
+        if "llm_requests_per_job" in previous:
+            rows.append(("LLM requests/job", previous["llm_requests_per_job"], result["llm_requests_per_job"]))
+        rows.append(("peak RSS MiB", previous["peak_rss_bytes"] / 2**20, result["peak_rss_bytes"] / 2**20))
+        print(f"  {result['name']}")
+        for label, before, after in rows:
+            change = (after - before) / before if before else 0.0
+            print(f"    {label:<20}{before:>10.3f}{after:>10.3f}{change:>+9.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline end to end against fake services")
+    parser.add_argument("--scenarios", help="JSON file with a list of scenarios (defaults to the built-in set)")
+    parser.add_argument("--only", nargs="*", help="Run only the named scenarios")
+    parser.add_argument("--output", help="Results file (defaults to benchmarks/results/e2e-<commit>-<time>.json)")
+    parser.add_argument("--compare", help="Earlier results file to compare against")
+    parser.add_argument("--work-dir", help="Directory for generated media and outputs (defaults to a temp dir)")
+    parser.add_argument("--ffmpeg", default=shutil.which('ffmpeg') or 'ffmpeg', help="ffmpeg used to generate media")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for injected latency and failures")
+    parser.add_argument("--verbose", action="store_true", help="Show pipeline log output")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child)
+        return
+
+    scenarios = SCENARIOS
+    if args.scenarios:
+        with open(args.scenarios) as f:
+            scenarios = json.load(f)
+    if args.only:
+        scenarios = [scenario for scenario in scenarios if scenario["name"] in args.only]
+
+    with open(os.path.join(REPO_DIR, 'config', 'config-example.yaml')) as f:
+        base_config = {**yaml.safe_load(f), **BASE_CONFIG, "ffmpeg_path": args.ffmpeg}
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='pipeline-e2e-')
+    os.makedirs(os.path.join(work_dir, 'media'), exist_ok=True)
+
+    results = []
+    with FakeServices(seed=args.seed) as services:
+        default_settings = json.loads(json.dumps(services.settings))
+        for scenario in scenarios:
+            services.settings = json.loads(json.dumps(default_settings))
+            result = run_scenario(scenario, services, base_config, work_dir, args.ffmpeg, args.verbose)
+            print_result(result)
+            results.append(result)
+
+    revision = git_revision()
+    output = args.output or os.path.join(
+        BENCHMARK_DIR, 'results', f"e2e-{revision}-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({
+            "commit": revision,
+            "created_at": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "scenarios": results,
+        }, f, indent=2)
+    print(f"\nResults saved to {output}")
+    if args.compare:
+        compare(results, args.compare)
+    if not args.work_dir:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""Measure cold-start import time of the CLI and server entry points.
+
+Usage: python benchmarks/startup.py [--runs 10] [--ref HEAD~1] [--output results.json]
+
+Each run imports `cli` or `server` in a fresh interpreter with
+`python -X importtime`, from a scratch directory and with the example config,
+and records the wall time of the whole process and the import time reported
+for the entry point. The slowest modules and which heavy third-party packages
+got imported are listed per entry point. `--ref` runs the same measurement on
+the backend of an earlier git revision for comparison.
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+from io import BytesIO
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+
+ENTRY_POINTS = ("cli", "server")
+HEAVY_PACKAGES = ("boto3", "botocore", "numpy", "requests", "httpx", "yaml", "fastapi", "pydantic", "uvicorn")
+
+
+def parse_importtime(stderr):
+    # Lines look like "import time:   self [us] |   cumulative | imported package"
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules.append((name.strip(), int(self_us), int(cumulative_us)))
+    return modules
+
+
+def measure_once(backend_dir, entry_point, work_dir):
+    code = f"import sys; sys.path.insert(0, {backend_dir!r}); import {entry_point}"
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=work_dir,
+        env={**os.environ, "AI_VIDEO_SUMMARIZER_CONFIG": os.path.join(REPO_DIR, "config", "config-example.yaml")},
+        capture_output=True,
+        text=True,
+    )
+    wall_seconds = time.perf_counter() - started
+    if result.returncode != 0:
+        error = result.stderr.strip().splitlines()[-1] if result.stderr.strip() else f"exit code {result.returncode}"
+        return {"error": error}
+    modules = parse_importtime(result.stderr)
+    return {
+        "wall_seconds": wall_seconds,
+        "import_seconds": next(cumulative for name, _, cumulative in modules if name == entry_point) / 1e6,
+        "modules": modules,
+    }
+
+
+def measure(backend_dir, entry_point, runs):
+    with tempfile.TemporaryDirectory(prefix="startup-") as work_dir:
+        samples = [measure_once(backend_dir, entry_point, work_dir) for _ in range(runs)]
+    errors = [sample["error"] for sample in samples if "error" in sample]
+    if errors:
+        return {"error": errors[0]}
+    modules = {name: self_us for name, self_us, _ in samples[-1]["modules"]}
+    return {
+        "wall_seconds": round(statistics.median(sample["wall_seconds"] for sample in samples), 4),
+        "import_seconds": round(statistics.median(sample["import_seconds"] for sample in samples), 4),
+        "heavy_packages": [name for name in HEAVY_PACKAGES if name in modules],
+        "slowest_modules": sorted(modules.items(), key=lambda item: item[1], reverse=True)[:10],
+    }
+
+
+def export_backend(ref):
+    archive = subprocess.run(["git", "archive", ref, "backend"], cwd=REPO_DIR, capture_output=True, check=True).stdout
+    directory = tempfile.mkdtemp(prefix="startup-ref-")
+    with tarfile.open(fileobj=BytesIO(archive)) as tar:
+        tar.extractall(directory)
+    return os.path.join(directory, "backend")
+
+
+def print_result(label, entry_point, result):
+    if "error" in result:
+        print(f"{label:<12}{entry_point:<8}failed: {result['error']}")
+        return
+    print(
+        f"{label:<12}{entry_point:<8}{result['wall_seconds'] * 1000:>10.1f} ms{result['import_seconds'] * 1000:>12.1f} ms"
+        f"   {', '.join(result['heavy_packages']) or '-'}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10, help="Fresh interpreters per entry point (the median is reported)")
+    parser.add_argument("--ref", help="Also measure the backend of this git revision")
+    parser.add_argument("--output", help="Write the results as JSON")
+    args = parser.parse_args()
+
+    targets = [("current", os.path.join(REPO_DIR, "backend"))]
+    if args.ref:
+        targets.insert(0, (args.ref, export_backend(args.ref)))
+
+    results = {}
+    print(f"{'revision':<12}{'entry':<8}{'process':>13}{'import':>15}   heavy packages imported")
+    for label, backend_dir in targets:
+        for entry_point in ENTRY_POINTS:
+            result = measure(backend_dir, entry_point, args.runs)
+            results.setdefault(label, {})[entry_point] = result
+            print_result(label, entry_point, result)
+
+    for entry_point in ENTRY_POINTS:
+        result = results["current"][entry_point]
+        if "error" not in result:
+            print(f"\nSlowest modules imported by {entry_point} (self time):")
+            for name, self_us in result["slowest_modules"]:
+                print(f"  {name:<40}{self_us / 1000:>8.1f} ms")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.ref:
+        shutil.rmtree(os.path.dirname(targets[0][1]), ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
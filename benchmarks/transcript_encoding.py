@@ -0,0 +1,73 @@
+"""Compare the size of JSON and compact transcript encodings used in LLM prompts.
+
+Usage: python benchmarks/transcript_encoding.py [transcript.json ...]
+
+Without arguments, synthetic WhisperX-style transcripts of several lengths are
+used. Token counts are approximated at four characters per token.
+"""
+import json
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from transcript_format import serialize_transcript  # noqa: E402
+
+
+WORDS = (
+    "the we so and I think that is really about what you know going project team "
+    "budget launch customer feedback model data question right yeah okay next week "
+    "design review meeting deadline release plan actually important point um"
+).split()
+
+
+def synthetic_transcript(minutes, seed=0):
+    rng = random.Random(seed)
+    transcript = []
+    t = rng.uniform(0, 1)
+    while t < minutes * 60:
+        # WhisperX segments are mostly a few seconds long with a tail of short interjections
+        duration = rng.choice([rng.uniform(0.4, 1.8), rng.uniform(2, 9), rng.uniform(2, 9)])
+        words = max(1, int(duration * rng.uniform(2.0, 3.2)))
+        transcript.append({
+            "start": t,
+            "end": t + duration,
+            "text": " " + " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + ".",
+        })
+        t += duration + rng.uniform(0, 0.8)
+    return transcript
+
+
+def approx_tokens(text):
+    return len(text) // 4 + 1
+
+
+def report(name, transcript):
+    baseline = json.dumps(transcript)
+    rows = [("json", baseline)]
+    for precision, merge_seconds in ((1, 0), (1, 3.0), (0, 5.0)):
+        config = {"transcript_time_precision": precision, "transcript_merge_seconds": merge_seconds}
+        rows.append((f"compact p={precision} merge={merge_seconds:g}s", serialize_transcript(transcript, config)))
+
+    print(f"\n{name}: {len(transcript)} segments")
+    print(f"  {'encoding':<28}{'bytes':>12}{'~tokens':>10}{'saved':>8}")
+    for label, text in rows:
+        size = len(text.encode('utf-8'))
+        saved = 1 - size / len(baseline.encode('utf-8'))
+        print(f"  {label:<28}{size:>12}{approx_tokens(text):>10}{saved:>8.0%}")
+
+
+def main(paths):
+    if paths:
+        for path in paths:
+            with open(path) as f:
+                data = json.load(f)
+            report(os.path.basename(path), data.get("segments", data) if isinstance(data, dict) else data)
+    else:
+        for minutes in (10, 60, 180):
+            report(f"synthetic {minutes} min", synthetic_transcript(minutes))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])